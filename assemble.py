@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# Assembles inst.txt once into the binary form scoreboard.py and batch.py load
+# directly, with every line already decoded and every label resolved to a PC.
+#
+#     python assemble.py inst.txt inst.prog
+#     python scoreboard.py inst.prog data.txt config.txt result.txt
+import argparse
+
+import scoreboard
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="python assemble.py inst.txt program_file")
+    parser.add_argument('inst_file')
+    parser.add_argument('program_file')
+    args = parser.parse_args()
+    f = open(args.inst_file, "rb")
+    program = scoreboard.assemble(f)
+    f.close()
+    f = open(args.program_file, "wb")
+    scoreboard.write_program(program, f)
+    f.close()
+    print "Assembled %s instructions and %s labels into %s" %(len(program['instructions']), len(program['labels']), args.program_file)
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# Runs many simulations listed in a manifest over a pool of worker processes
+# and prints one summary table. Each manifest line names the four files of a
+# run, in the same order as scoreboard.py takes them:
+#
+#     inst.txt data.txt config.txt result.txt
+#
+# Relative paths are taken from the manifest's directory, and blank lines and
+# lines starting with '#' are skipped.
+import os
+import sys
+import signal
+import argparse
+import traceback
+import multiprocessing
+
+import scoreboard
+
+
+class RunTimeout(Exception):
+    pass
+
+def read_manifest(manifest_file):
+    runs = []
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    f = open(manifest_file)
+    for line_no, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        files = line.split()
+        if len(files) != 4:
+            print "INVALID MANIFEST LINE %s:%s. Expected inst, data, config and result files." %(line_no, line)
+            sys.exit(1)
+        runs.append(tuple(os.path.join(base_dir, name) for name in files))
+    f.close()
+    return runs
+
+def init_worker():
+    # Invalid inputs are reported on stdout before exiting, which would
+    # interleave across workers.
+    sys.stdout = open(os.devnull, 'w')
+
+def raise_timeout(signum, frame):
+    raise RunTimeout()
+
+# Programs already decoded by this worker, keyed by instruction file.
+SIMULATORS = {}
+
+def get_simulator(inst_file, program_cache):
+    if inst_file not in SIMULATORS:
+        SIMULATORS[inst_file] = scoreboard.Simulator(scoreboard.read_program_file(inst_file, program_cache))
+    return SIMULATORS[inst_file]
+
+def run_one(job):
+    # Each run starts from a clean Simulator state, so a worker process can be
+    # reused for any number of runs and decodes each program only once.
+    run, skip_idle_cycles, timeout, program_cache = job
+    inst_file, data_file, config_file, result_file = run
+    if timeout:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.alarm(timeout)
+    try:
+        simulator = get_simulator(inst_file, program_cache)
+        f2 = open(config_file, "rb")
+        simulator.load_config(f2)
+        f2.close()
+        f3 = open(data_file, "rb")
+        simulator.load_data(f3)
+        f3.close()
+        f4 = open(result_file, "wb")
+        try:
+            summary = simulator.run(f4, skip_idle_cycles=skip_idle_cycles)
+        finally:
+            f4.close()
+        summary['status'] = 'OK'
+    except RunTimeout:
+        summary = {'status': 'TIMEOUT'}
+    except SystemExit:
+        # Invalid instructions or unit names exit while being read.
+        summary = {'status': 'INVALID'}
+    except Exception:
+        summary = {'status': 'ERROR', 'error': traceback.format_exc()}
+    finally:
+        if timeout:
+            signal.alarm(0)
+    return run, summary
+
+def format_row(name, values):
+    return "%-30s %-8s " %(name[-30:], values[0]) + " ".join("%-12s" %(v) for v in values[1:])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="python batch.py manifest.txt [--processes N] [--timeout SECONDS] [--program-cache DIR] [--summary FILE]")
+    parser.add_argument('manifest')
+    parser.add_argument('--processes', type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    parser.add_argument('--timeout', type=int, default=0,
+                        help="give up on a run after this many seconds (default: no limit)")
+    parser.add_argument('--event-driven', action='store_true',
+                        help="pass --event-driven to every run")
+    parser.add_argument('--program-cache', metavar='DIR',
+                        help="keep assembled programs in DIR, shared by all workers and later batches")
+    parser.add_argument('--summary', help="also write the table to this file")
+    args = parser.parse_args()
+    runs = read_manifest(args.manifest)
+    pool = multiprocessing.Pool(args.processes, init_worker)
+    lines = [format_row('Result', ['Status'] + scoreboard.SUMMARY_FIELDS)]
+    jobs = [(run, args.event_driven, args.timeout, args.program_cache) for run in runs]
+    for run, summary in pool.imap(run_one, jobs):
+        values = [summary.get(field, '') for field in scoreboard.SUMMARY_FIELDS]
+        lines.append(format_row(os.path.basename(run[3]), [summary['status']] + values))
+        if summary['status'] == 'ERROR':
+            sys.stderr.write("%s failed:\n%s" %(run[3], summary['error']))
+    pool.close()
+    pool.join()
+    for line in lines:
+        print line
+    if args.summary:
+        f = open(args.summary, 'w')
+        f.write("\n".join(lines) + "\n")
+        f.close()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# Micro-benchmark of the read-operands/execute path for a mix of integer,
+# FP and memory instructions. Pass several --module paths (e.g. an older
+# checkout of scoreboard.py) to compare them.
+import os
+import imp
+import time
+import argparse
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILE = os.path.join(ROOT_DIR, 'mayurp1', 'data.txt')
+INSTRUCTION_MIX = ['DADD R5, R6, R7', 'DADDI R8, R6, 12', 'DSUB R9, R7, R6', 'DSUBI R10, R7, 3',
+                    'AND R11, R6, R7', 'ORI R12, R7, 5', 'ADD.D F1, F2, F3', 'MUL.D F4, F1, F2',
+                    'LW R5, 8(R4)', 'SW R6, 12(R4)', 'L.D F6, 16(R4)', 'S.D F7, 20(R4)']
+
+def load_module(path, index):
+    return imp.load_source('scoreboard_bench_%s' %(index), path)
+
+def time_execute_stage(module, iterations):
+    program = ["%s\n" %(ins) for ins in INSTRUCTION_MIX]
+    f = open(DATA_FILE)
+    if hasattr(module, 'Simulator'):
+        if hasattr(module, 'assemble'):
+            program = module.assemble(program)
+        simulator = module.Simulator(program)
+        simulator.load_data(f)
+        simulator.init_scoreboard()
+        ins_dict = simulator.ins_dict
+        registers = simulator.int_registers
+        read_operands, execute_instruction = simulator.read_operands, simulator.execute_instruction
+    else:
+        # Older checkouts keep the simulator state in module globals.
+        ins_dict = module.read_instructions(program)[0]
+        module.read_data(f)
+        registers = module.INT_REGISTERS
+        read_operands = getattr(module, 'read_operands', None) or module.read_operands_and_make_expression
+        execute_instruction = module.execute_instruction
+    f.close()
+    instructions = [ins_dict[key] for key in sorted(ins_dict)]
+    registers[3] = 256
+    registers[5] = 40
+    registers[6] = 24
+    # Older checkouts keep each instruction as a dict.
+    is_dict = isinstance(instructions[0], dict)
+    start = time.time()
+    for _ in xrange(iterations):
+        for instruction in instructions:
+            if is_dict:
+                instruction['exp'] = read_operands(instruction)
+            else:
+                instruction.exp = read_operands(instruction)
+            execute_instruction(instruction)
+    return time.time() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--module', action='append',
+                        help="scoreboard.py to time (default: the one in this checkout)")
+    args = parser.parse_args()
+    modules = args.module or [os.path.join(ROOT_DIR, 'scoreboard.py')]
+    executed = args.iterations * len(INSTRUCTION_MIX)
+    print "%-40s %-10s %-10s %-10s" %('Module', 'Executed', 'Seconds', 'us/instr')
+    for index, path in enumerate(modules):
+        elapsed = time_execute_stage(load_module(path, index), args.iterations)
+        print "%-40s %-10s %-10.3f %-10.3f" %(path[-40:], executed, elapsed, elapsed * 1e6 / executed)
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# Times scoreboard.py on a long straight-line program and reports simulated
+# cycles per second. Pass several --script paths (e.g. an older checkout of
+# scoreboard.py) to compare them on the same program.
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILE = os.path.join(ROOT_DIR, 'mayurp1', 'data.txt')
+CONFIG_FILE = os.path.join(ROOT_DIR, 'mayurp1', 'config.txt')
+
+def make_program(num_instructions):
+    # Integer-only so every instruction goes through the single INTEGER unit,
+    # and every line is distinct so the old text lookup still resolves it.
+    lines = []
+    for i in range(num_instructions):
+        lines.append("DADDI R%s, R%s, %s" %(5 + i % 8, 5 + (i + 3) % 8, i + 1))
+    lines.append("HLT")
+    lines.append("HLT")
+    return "\n".join(lines) + "\n"
+
+def simulated_cycles(result_file):
+    last_cycle = 0
+    f = open(result_file)
+    for line in f:
+        if not line.strip() or line.startswith('Instruction') or line.startswith('Total') or line.startswith('Number'):
+            continue
+        for field in line[21:].split():
+            if field.isdigit():
+                last_cycle = max(last_cycle, int(field))
+    f.close()
+    return last_cycle
+
+def run_script(script, inst_file, result_file):
+    devnull = open(os.devnull, 'w')
+    start = time.time()
+    subprocess.check_call([sys.executable, script, inst_file, DATA_FILE, CONFIG_FILE, result_file], stdout=devnull)
+    elapsed = time.time() - start
+    devnull.close()
+    return elapsed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--instructions', type=int, default=10000)
+    parser.add_argument('--script', action='append',
+                        help="scoreboard.py to time (default: the one in this checkout)")
+    args = parser.parse_args()
+    scripts = args.script or [os.path.join(ROOT_DIR, 'scoreboard.py')]
+    work_dir = tempfile.mkdtemp()
+    inst_file = os.path.join(work_dir, 'inst.txt')
+    f = open(inst_file, 'w')
+    f.write(make_program(args.instructions))
+    f.close()
+    print "%-40s %-8s %-8s %-10s %-12s" %('Script', 'Instrs', 'Cycles', 'Seconds', 'Cycles/sec')
+    for script in scripts:
+        result_file = os.path.join(work_dir, 'result.txt')
+        elapsed = run_script(script, inst_file, result_file)
+        cycles = simulated_cycles(result_file)
+        print "%-40s %-8s %-8s %-10.2f %-12.0f" %(script[-40:], args.instructions, cycles, elapsed, cycles / elapsed)
+    shutil.rmtree(work_dir)
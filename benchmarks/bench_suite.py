@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# Runs generated workloads through Simulator.run and reports simulator speed
+# as simulated cycles and retired instructions per wall-clock second, with the
+# peak memory of the run. Every invocation is appended to a history file and
+# compared with the previous entry, so slowdowns show up as they land.
+#
+#     python benchmarks/bench_suite.py [--size N] [--workload NAME] [--history FILE]
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import multiprocessing
+from cStringIO import StringIO
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+import scoreboard
+
+DATA_FILE = os.path.join(ROOT_DIR, 'mayurp1', 'data.txt')
+CONFIG_FILE = os.path.join(ROOT_DIR, 'mayurp1', 'config.txt')
+HISTORY_FILE = os.path.join(ROOT_DIR, 'benchmarks', 'bench_history.jsonl')
+
+def loop_program(size):
+    # A short integer loop body run size times.
+    return ["LI R1, %s" %(size), "LI R2, 0",
+            "LOOP: DADDI R2, R2, 1", "DADD R3, R3, R2", "ANDI R4, R3, 255", "DSUBI R1, R1, 1",
+            "BNE R1, R0, LOOP", "HLT", "HLT"]
+
+def fp_divide_program(size):
+    # Dependent chains through the single unpipelined FP divider.
+    return ["LI R1, %s" %(max(1, size / 8)),
+            "LOOP: DIV.D F1, F2, F3", "ADD.D F4, F1, F5", "DIV.D F6, F4, F7", "MUL.D F8, F6, F1",
+            "DSUBI R1, R1, 1", "BNE R1, R0, LOOP", "HLT", "HLT"]
+
+def stride_program(size):
+    # Loads and stores one D-cache block apart over the whole data segment,
+    # which is twice the size of the default D-cache.
+    lines = ["LI R1, %s" %(max(1, size / 8)), "LI R4, 256"]
+    body = []
+    for index in range(8):
+        if index % 2:
+            body.append("SW R5, %s(R4)" %(index * 16))
+        else:
+            body.append("LW R5, %s(R4)" %(index * 16))
+    body[0] = "LOOP: " + body[0]
+    return lines + body + ["DSUBI R1, R1, 1", "BNE R1, R0, LOOP", "HLT", "HLT"]
+
+def branch_program(size):
+    # Mostly branches: a taken and a not-taken BEQ for every few integer ops.
+    return ["LI R1, %s" %(size), "LI R6, 1",
+            "LOOP: BEQ R1, R6, DONE", "DADDI R2, R2, 1", "BEQ R0, R0, NEXT", "DADDI R3, R3, 1",
+            "NEXT: DSUBI R1, R1, 1", "BNE R1, R0, LOOP",
+            "DONE: DADDI R4, R2, 0", "HLT", "HLT"]
+
+WORKLOADS = [('loop', loop_program), ('fp_divide', fp_divide_program), ('stride', stride_program),
+            ('branch', branch_program)]
+
+def run_workload(job):
+    # Runs in a fresh worker process so that ru_maxrss is the peak of this
+    # workload alone.
+    name, size, skip_idle_cycles = job
+    lines = dict(WORKLOADS)[name](size)
+    simulator = scoreboard.Simulator(scoreboard.assemble(["%s\n" %(line) for line in lines]))
+    f = open(CONFIG_FILE, 'rb')
+    simulator.load_config(f)
+    f.close()
+    f = open(DATA_FILE, 'rb')
+    simulator.load_data(f)
+    f.close()
+    start = time.time()
+    summary = simulator.run(StringIO(), skip_idle_cycles=skip_idle_cycles)
+    elapsed = time.time() - start
+    # ru_maxrss is in kilobytes on Linux.
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {'workload': name, 'size': size, 'cycles': summary['cycles'], 'instructions': summary['instructions'],
+            'seconds': elapsed, 'cycles_per_second': summary['cycles'] / elapsed,
+            'instructions_per_second': summary['instructions'] / elapsed, 'peak_memory_kb': peak_memory}
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR,
+                                        stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def read_last_entry(history_file, event_driven):
+    # The latest earlier run in the same clock mode, whose speeds are comparable.
+    last = None
+    if os.path.exists(history_file):
+        f = open(history_file)
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if entry['event_driven'] == event_driven:
+                    last = entry
+        f.close()
+    return last
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=2000,
+                        help="loop iterations (or their equivalent) of every workload")
+    parser.add_argument('--workload', action='append', choices=[name for name, _ in WORKLOADS],
+                        help="workload to run (default: all)")
+    parser.add_argument('--event-driven', action='store_true')
+    parser.add_argument('--history', default=HISTORY_FILE,
+                        help="append the results to this file (default: benchmarks/bench_history.jsonl)")
+    args = parser.parse_args()
+    names = args.workload or [name for name, _ in WORKLOADS]
+    previous = read_last_entry(args.history, args.event_driven)
+    previous_results = {}
+    if previous:
+        previous_results = dict(((result['workload'], result['size']), result) for result in previous['results'])
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+    results = pool.map(run_workload, [(name, args.size, args.event_driven) for name in names])
+    pool.close()
+    pool.join()
+    print "%-10s %-8s %-8s %-8s %-10s %-12s %-12s %-10s %s" %('Workload', 'Size', 'Cycles', 'Instrs', 'Seconds',
+                                            'Cycles/sec', 'Instrs/sec', 'Peak KB', 'vs last')
+    for result in results:
+        change = ''
+        last = previous_results.get((result['workload'], result['size']))
+        if last:
+            change = "%+.1f%%" %((result['cycles_per_second'] / last['cycles_per_second'] - 1) * 100)
+        print "%-10s %-8s %-8s %-8s %-10.3f %-12.0f %-12.0f %-10s %s" %(result['workload'], result['size'],
+                        result['cycles'], result['instructions'], result['seconds'], result['cycles_per_second'],
+                        result['instructions_per_second'], result['peak_memory_kb'], change)
+    entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'revision': git_revision(), 'event_driven': args.event_driven,
+                'results': results}
+    f = open(args.history, 'a')
+    f.write(json.dumps(entry, sort_keys=True) + "\n")
+    f.close()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+# Checks that the ways of running a program that should not change its timing
+# agree with a plain run: --event-driven, --memoize-blocks, and a snapshot
+# taken half way through followed by --resume, whose two result files joined
+# must be the plain result. Every generated program and mayurp1 example is run
+# with each config below, and mayurp1/example4.txt with config_fifo.txt must
+# also give mayurp1/result_fifo.txt. Exits with 1 on any difference.
+#
+#     python benchmarks/check_modes.py [--programs N] [--seed N] [--timeout SECONDS] [--processes N]
+import os
+import sys
+import random
+import shutil
+import signal
+import argparse
+import tempfile
+import traceback
+import multiprocessing
+from cStringIO import StringIO
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+import scoreboard
+
+EXAMPLE_DIR = os.path.join(ROOT_DIR, 'mayurp1')
+DATA_FILE = os.path.join(EXAMPLE_DIR, 'data.txt')
+EXAMPLES = ['inst.txt', 'example1.txt', 'example2.txt', 'example3.txt', 'example4.txt']
+CONFIGS = [('config', open(os.path.join(EXAMPLE_DIR, 'config.txt')).read()),
+            ('config_fifo', open(os.path.join(EXAMPLE_DIR, 'config_fifo.txt')).read()),
+            ('slow_units', "FP adder: 1, 3\nFP Multiplier: 1, 10\nFP divider: 1, 20\nI-Cache: 2, 4\n"),
+            ('fast_units', "FP adder: 3, 2\nFP Multiplier: 2, 5\nFP divider: 2, 8\nI-Cache: 8, 2\n")]
+# The run whose result file is kept in the repository, as (inst, config, result).
+EXPECTED_RESULTS = [('example4.txt', 'config_fifo', 'result_fifo.txt')]
+
+
+class RunTimeout(Exception):
+    pass
+
+def random_program(seed):
+    # Up to three counted loops of integer, FP, load and store instructions
+    # over the data segment, some with a jump over part of the body. Every
+    # line is different, as assemble takes an instruction's text as its key.
+    r = random.Random(seed)
+    int_regs = ["R%s" %(index) for index in range(5, 13)]
+    fp_regs = ["F%s" %(index) for index in range(1, 11)]
+    def random_instruction():
+        kind = r.random()
+        if kind < 0.25:
+            return "%s %s, %s, %s" %(r.choice(['DADD', 'DSUB', 'AND', 'OR']), r.choice(int_regs),
+                                    r.choice(int_regs), r.choice(int_regs))
+        if kind < 0.4:
+            return "%s %s, %s, %s" %(r.choice(['DADDI', 'DSUBI', 'ANDI', 'ORI']), r.choice(int_regs),
+                                    r.choice(int_regs), r.randint(1, 40))
+        if kind < 0.5:
+            return "LI %s, %s" %(r.choice(int_regs), r.randint(0, 300))
+        if kind < 0.72:
+            op = r.choice(['LW', 'L.D', 'SW', 'S.D'])
+            reg = r.choice(fp_regs if op.endswith('.D') else int_regs)
+            return "%s %s, %s(R4)" %(op, reg, 4 * r.randint(0, 28))
+        return "%s %s, %s, %s" %(r.choice(['ADD.D', 'SUB.D', 'MUL.D', 'DIV.D', 'ADD.D', 'SUB.D']),
+                                r.choice(fp_regs), r.choice(fp_regs), r.choice(fp_regs))
+    used = set(["LI R4, 256", "LI R3, 0"])
+    def unique_instruction():
+        while True:
+            line = random_instruction()
+            if line not in used:
+                used.add(line)
+                return line
+    lines = ["LI R4, 256", "LI R3, 0"]
+    for block in range(r.randint(1, 3)):
+        iterations = r.randint(1, 3)
+        while "LI R1, %s" %(iterations) in used:
+            iterations += 1
+        used.add("LI R1, %s" %(iterations))
+        lines.append("LI R1, %s" %(iterations))
+        body = [unique_instruction() for _ in range(r.randint(2, 9))]
+        body[0] = "L%s: %s" %(block, body[0])
+        lines.extend(body)
+        if r.random() < 0.3:
+            lines.extend(["J S%s" %(block), unique_instruction(), "S%s: %s" %(block, unique_instruction())])
+        lines.append("DSUBI R1, R1, 1" if block == 0 else "DADDI R1, R1, -1")
+        lines.append("BNE R1, R3, L%s" %(block))
+    lines.extend(unique_instruction() for _ in range(r.randint(0, 4)))
+    return ["%s\n" %(line) for line in lines + ["HLT", "HLT"]]
+
+def raise_timeout(signum, frame):
+    raise RunTimeout()
+
+def new_simulator(program, config_file):
+    simulator = scoreboard.Simulator(program)
+    f = open(config_file, 'rb')
+    simulator.load_config(f)
+    f.close()
+    f = open(DATA_FILE, 'rb')
+    simulator.load_data(f)
+    f.close()
+    return simulator
+
+def run_mode(program, config_file, **options):
+    f4 = StringIO()
+    summary = new_simulator(program, config_file).run(f4, **options)
+    return f4.getvalue(), summary
+
+def check_one(job):
+    # Returns the modes of one program and config that differ from its plain
+    # run, or the status of a run that did not finish.
+    name, program, config_file, snapshot_file, timeout = job
+    signal.signal(signal.SIGALRM, raise_timeout)
+    signal.alarm(timeout)
+    try:
+        plain = run_mode(program, config_file)
+        modes = [('--event-driven', run_mode(program, config_file, skip_idle_cycles=True)),
+                ('--memoize-blocks', run_mode(program, config_file, memo=scoreboard.BlockMemo()))]
+        paused_result, paused = run_mode(program, config_file, snapshot_at=max(1, plain[1]['cycles'] / 2),
+                                        snapshot_file=snapshot_file)
+        if paused.get('paused'):
+            resumed_result, resumed = run_mode(program, config_file, resume=scoreboard.read_snapshot(snapshot_file))
+            # The resumed result file has a header row of its own.
+            resumed_rows = resumed_result.split("\n", 1)[1]
+            modes.append(('--resume', (paused_result + resumed_rows, resumed)))
+        return name, 'OK', [mode for mode, run in modes if run != plain], plain[0]
+    except RunTimeout:
+        return name, 'TIMEOUT', [], None
+    except SystemExit:
+        return name, 'INVALID', [], None
+    except Exception:
+        return name, 'ERROR', [traceback.format_exc()], None
+    finally:
+        signal.alarm(0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--programs', type=int, default=200,
+                        help="generated programs to run besides the mayurp1 examples (default: 200)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed of the first generated program (default: 0)")
+    parser.add_argument('--timeout', type=int, default=60,
+                        help="give up on a program and config after this many seconds (default: 60)")
+    parser.add_argument('--processes', type=int, default=None,
+                        help="worker processes (default: one per CPU)")
+    args = parser.parse_args()
+    work_dir = tempfile.mkdtemp(prefix='check_modes')
+    try:
+        config_files = {}
+        for config_name, text in CONFIGS:
+            config_files[config_name] = os.path.join(work_dir, config_name + '.txt')
+            f = open(config_files[config_name], 'w')
+            f.write(text)
+            f.close()
+        programs = []
+        for example in EXAMPLES:
+            f = open(os.path.join(EXAMPLE_DIR, example))
+            programs.append((example, scoreboard.assemble(f.readlines())))
+            f.close()
+        for seed in range(args.seed, args.seed + args.programs):
+            programs.append(("p%s" %(seed), scoreboard.assemble(random_program(seed))))
+        jobs = []
+        for program_name, program in programs:
+            for config_name, _ in CONFIGS:
+                name = "%s %s" %(program_name, config_name)
+                jobs.append((name, program, config_files[config_name],
+                            os.path.join(work_dir, "%s.snapshot" %(len(jobs))), args.timeout))
+        pool = multiprocessing.Pool(args.processes)
+        results = dict((name, (status, differences, result))
+                        for name, status, differences, result in pool.imap_unordered(check_one, jobs))
+        pool.close()
+        pool.join()
+    finally:
+        shutil.rmtree(work_dir)
+    failures = 0
+    for name, _, _, _, _ in jobs:
+        status, differences, _ = results[name]
+        if status == 'ERROR':
+            failures += 1
+            sys.stderr.write("%s failed:\n%s" %(name, differences[0]))
+        elif status != 'OK':
+            # Every program here halts, so a timeout is a simulator hang.
+            failures += 1
+            print "%-30s %s" %(name, status)
+        elif differences:
+            failures += 1
+            print "%-30s differs from the plain run with %s" %(name, ', '.join(differences))
+    for inst, config_name, expected in EXPECTED_RESULTS:
+        name = "%s %s" %(inst, config_name)
+        f = open(os.path.join(EXAMPLE_DIR, expected), 'rb')
+        if results[name][0] == 'OK' and results[name][2] != f.read():
+            failures += 1
+            print "%-30s differs from mayurp1/%s" %(name, expected)
+        f.close()
+    print "Checked %s runs, %s failed." %(len(jobs), failures)
+    sys.exit(1 if failures else 0)
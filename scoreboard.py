@@ -1,6 +1,27 @@
 #!/usr/bin/env python
+import os
 import sys
-from copy import deepcopy
+import json
+import mmap
+import array
+import time
+import zlib
+import logging
+import copy
+import math
+import cPickle
+import hashlib
+import tempfile
+import struct
+import random
+import argparse
+import operator
+from cStringIO import StringIO
+from collections import namedtuple
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 VALID_INSTRUCTION_SET = ['LW', 'SW', 'L.D', 'S.D', 'DADD','DADDI','DSUB','DSUBI', 'AND', 'ANDI', 'OR', 
                         'ORI', 'LI', 'LUI', 'ADD.D', 'MUL.D', 'DIV.D', 'SUB.D', 'J', 'BEQ', 'BNE', 'HLT']
@@ -11,7 +32,35 @@ LOAD_INSTRUCTIONS = ['LW', 'L.D', 'LI', 'LUI']
 STORE_INSTRUCTIONS = ['SW', 'S.D']
 STRING_OPERTOR_MAP = {'DADD':'+','DADDI':'+', 'DSUB':'-','DSUBI':'-', 'ADD.D':'+', 'SUB.D':'-', 'MUL.D':'*','DIV.D':'/',
                         'AND':'&','ANDI':'&','OR':'|','ORI':'|'}
-FUNCTIONAL_UNITS = ['INTEGER','DATA TRANSFER', 'CONTROL','SPECIAL PURPOSE','FP ADDER','FP MULTIPLIER','FP DIVIDER','I-CACHE']
+IMMEDIATE_OPERAND_INSTRUCTIONS = ['DADDI','DSUBI','ANDI','ORI']
+FP_OPERAND_INSTRUCTIONS = ['ADD.D', 'MUL.D', 'SUB.D', 'DIV.D']
+FUNCTIONAL_UNITS = ['INTEGER','DATA TRANSFER', 'CONTROL','SPECIAL PURPOSE','FP ADDER','FP MULTIPLIER','FP DIVIDER','I-CACHE',
+                    'D-CACHE', 'BUS']
+REPLACEMENT_POLICIES = ['LRU', 'FIFO', 'RANDOM']
+BUS_POLICIES = ['PREEMPT', 'FIFO', 'I-CACHE', 'D-CACHE']
+BUS_REQUESTERS = ['i_cache', 'd_cache']
+# Leads every file written by write_program, followed by the version; bump the
+# version whenever the assembled form changes so stale files are not used.
+ASSEMBLED_PROGRAM_MAGIC = 'CDC6600 SCOREBOARD PROGRAM '
+ASSEMBLED_PROGRAM_HEADER = ASSEMBLED_PROGRAM_MAGIC + '2\n'
+COLUMNAR_RESULT_HEADER = 'CDC6600 SCOREBOARD TIMING 1\n'
+COLUMNAR_CHUNK_ROWS = 65536
+SUMMARY_FIELDS = ['cycles', 'instructions', 'i_cache_accesses', 'i_cache_hits', 'd_cache_accesses', 'd_cache_hits']
+# 95% two-sided normal quantile, for the confidence intervals of sampled runs.
+CONFIDENCE_Z = 1.96
+SNAPSHOT_HEADER = 'CDC6600 SCOREBOARD SNAPSHOT 2\n'
+PIPELINE_STAGES = ['fetch', 'issue', 'read', 'execute', 'write']
+STALL_CAUSES = ['raw', 'waw', 'structural', 'i_cache', 'd_cache', 'bus']
+DATA_BASE_ADDRESS = 256
+DATA_WORD = struct.Struct('>I')
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING']
+# BlockMemo keeps at most MEMO_MAX_BLOCKS blocks, of up to MEMO_MAX_OPS operations.
+MEMO_MAX_BLOCKS = 4096
+MEMO_MAX_OPS = 4096
+# Blocks shorter than this cost more to replay than to run in detail, so their
+# leaders stop starting blocks and they become part of the blocks around them.
+MEMO_MIN_CYCLES = 8
+MEMO_COUNTERS = ['i_cache_miss_count', 'i_cache_access_count', 'd_cache_miss_count', 'd_cache_access_count']
 INSTRUCTION_UNIT_MAP = {'LW': {'unit':'DATA TRANSFER', 'num_cycles':1},'SW': {'unit':'DATA TRANSFER', 'num_cycles':1},
                         'L.D': {'unit':'DATA TRANSFER', 'num_cycles':2},'S.D':{'unit':'DATA TRANSFER', 'num_cycles':2},
                         'HLT':{'unit':'SPECIAL PURPOSE', 'num_cycles':0},'J':{'unit':'CONTROL', 'num_cycles':0}, 
@@ -23,14 +72,692 @@ INSTRUCTION_UNIT_MAP = {'LW': {'unit':'DATA TRANSFER', 'num_cycles':1},'SW': {'u
                         'LI':{'unit':'INTEGER', 'num_cycles':1},'LUI':{'unit':'INTEGER', 'num_cycles':1},
                         'ADD.D':{'unit':'FP ADDER', 'num_cycles':0},'SUB.D':{'unit':'FP ADDER', 'num_cycles':0},
                         'MUL.D':{'unit':'FP MULTIPLIER', 'num_cycles':0},'DIV.D':{'unit':'FP DIVIDER', 'num_cycles':0}}
-INT_REGISTERS = [0] * 32
-MEMORY_LOCATIONS = [0] * 32
-DATA_MEM = {}
-SET0_CACHE = {'latest_block_index':0, 'blocks': [{},{}]}
-SET1_CACHE ={'latest_block_index':0, 'blocks': [{},{}]}
-I_CACHE_BLOCK_SIZE = 0
-I_CACHE_WORD_SIZE = 0
-I_CACHE = []
+
+# Silent unless the caller configures logging, e.g. with --log-level.
+log = logging.getLogger('scoreboard')
+log.addHandler(logging.NullHandler())
+
+def divide_operands(v1, v2):
+    # FP registers are not modelled and always read as 0, so DIV.D has no result.
+    if v2 == 0:
+        return None
+    return v1 / v2
+
+# operand_type is 'REGISTER' (both operands are registers), 'IMMEDIATE' (op2 is
+# an immediate) or 'FP' (floating point registers, which read as 0).
+Operation = namedtuple('Operation', ['function', 'operand_type'])
+OPERATOR_FUNCTIONS = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': divide_operands,
+                        '&': operator.and_, '|': operator.or_}
+OPERATION_TABLE = {}
+for ins_str, symbol in STRING_OPERTOR_MAP.iteritems():
+    if ins_str in IMMEDIATE_OPERAND_INSTRUCTIONS:
+        operand_type = 'IMMEDIATE'
+    elif ins_str in FP_OPERAND_INSTRUCTIONS:
+        operand_type = 'FP'
+    else:
+        operand_type = 'REGISTER'
+    OPERATION_TABLE[ins_str] = Operation(OPERATOR_FUNCTIONS[symbol], operand_type)
+
+class Instruction(object):
+    # A decoded instruction together with its in-flight pipeline state. The
+    # decoded fields, the branch target PC and the unit are resolved once in
+    # read_instructions and num_cycles once per run in init_scoreboard; clocks
+    # holds the Fetch, Issue, Read, Exec and Write cycles followed by the RAW,
+    # WAW and Struct flags.
+    __slots__ = ('pc', 'label', 'ins_str', 'des', 'op1', 'op2', 'jump_label', 'target', 'displacement', 'complete_ins',
+                'functional_unit', 'operation', 'num_cycles',
+                'state', 'stall_lock', 'f_unit_index', 'exp', 'temp_result', 'incomplete_index',
+                'output_count', 'clocks', 'branch_next_ins', 'd_cache_miss_penalty')
+
+    def __init__(self, pc, label, ins_str, des, op1, op2, jump_label, target, displacement, complete_ins):
+        self.pc = pc
+        self.label = label
+        self.ins_str = ins_str
+        self.des = des
+        self.op1 = op1
+        self.op2 = op2
+        self.jump_label = jump_label
+        self.target = target
+        self.displacement = displacement
+        self.complete_ins = complete_ins
+        self.functional_unit = INSTRUCTION_UNIT_MAP.get(ins_str).get('unit')
+        self.operation = OPERATION_TABLE.get(ins_str)
+        self.num_cycles = INSTRUCTION_UNIT_MAP.get(ins_str).get('num_cycles')
+        self.state = -1
+        self.stall_lock = False
+        self.f_unit_index = -1
+        self.exp = None
+        self.temp_result = -1
+        self.incomplete_index = -1
+        self.output_count = 0
+        self.clocks = [-1,-1,-1,-1,-1,'N','N','N']
+        self.branch_next_ins = False
+        self.d_cache_miss_penalty = 0
+
+    def fetch(self, output_count):
+        # A fresh in-flight instance of this decoded instruction. The entries of
+        # ins_dict are never put in the pipeline themselves, so each dynamic
+        # instance (e.g. every loop iteration) has its own state and clocks.
+        copy = Instruction.__new__(Instruction)
+        for name in self.__slots__:
+            setattr(copy, name, getattr(self, name))
+        copy.output_count = output_count
+        copy.clocks = [-1,-1,-1,-1,-1,'N','N','N']
+        return copy
+
+    def __repr__(self):
+        return repr(dict((name, getattr(self, name)) for name in self.__slots__))
+
+# The architectural state fast_forward hands to a timed run: the PC to resume at,
+# how many instructions were executed to get there, the integer registers, the
+# stores made to data memory and copies of both caches.
+Checkpoint = namedtuple('Checkpoint', ['pc', 'instructions', 'int_registers', 'data_stores', 'i_cache', 'd_cache'])
+
+# The fields of an Instruction that change while it is in flight. A snapshot
+# keeps only these and the PC, and rebuilds the rest from the program.
+IN_FLIGHT_FIELDS = ('state', 'stall_lock', 'f_unit_index', 'exp', 'temp_result', 'incomplete_index',
+                    'output_count', 'clocks', 'branch_next_ins', 'd_cache_miss_penalty')
+
+def save_in_flight(instruction):
+    return (instruction.pc,) + tuple(getattr(instruction, name) for name in IN_FLIGHT_FIELDS)
+
+def restore_in_flight(record, ins_dict):
+    instruction = ins_dict.get(record[0]).fetch(0)
+    for name, value in zip(IN_FLIGHT_FIELDS, record[1:]):
+        setattr(instruction, name, value)
+    return instruction
+
+# What is kept of an instruction once it leaves the pipeline: its fetch order,
+# program counter and the eight columns of its result.txt row.
+TimingRow = namedtuple('TimingRow', ['output_count', 'pc', 'fetch', 'issue', 'read', 'execute', 'write',
+                                    'raw', 'waw', 'struct'])
+
+def summary_lines(summary):
+    # The cache counters that close result.txt and the output of a run.
+    lines = ["Total Number of access requsts for instruction cahce:%s" %(summary['i_cache_accesses']),
+            "Number of instruction cahce hits:%s" %(summary['i_cache_hits']),
+            "Total Number of Cache requsts for Data Cache:%s" %(summary['d_cache_accesses']),
+            "Total Number of Cache Hits for Data Cache:%s" %(summary['d_cache_hits'])]
+    estimates = summary.get('estimates')
+    if estimates:
+        # Sampled runs: the counters above are those of the timed windows.
+        lines.append("Sampled windows:%s of up to %s instructions, one every %s of %s instructions"
+                        %(summary['samples'], summary['sample_size'], summary['sample_period'], summary['instructions']))
+        for name in ['cpi', 'cycles'] + ['%s_stall_cycles_per_instruction' %(cause) for cause in STALL_CAUSES] + \
+                    ['i_cache_hit_rate', 'd_cache_hit_rate']:
+            value, half_width = estimates[name]
+            lines.append("Estimated %s:%s +/- %s" %(name, format_estimate(value), format_estimate(half_width)))
+    return lines
+
+def bus_lines(bus_stats):
+    # The bus statistics printed after a run.
+    lines = []
+    for requester in BUS_REQUESTERS:
+        stats = bus_stats[requester]
+        lines.append("Bus refills for %s:%s, transfer cycles:%s, wait cycles:%s" %(requester, stats['refills'],
+                                                            stats['transfer_cycles'], stats['wait_cycles']))
+    return lines
+
+def format_estimate(value):
+    if value is None:
+        return 'n/a'
+    return "%.3f" %(value)
+
+def ratio_estimate(numerators, denominators):
+    # The ratio of the totals over all samples and the half width of its
+    # confidence interval, from the usual variance of a ratio estimator. None
+    # where there is nothing to divide by or too few samples.
+    n = len(numerators)
+    total = float(sum(denominators))
+    if not total:
+        return None, None
+    ratio = sum(numerators) / total
+    if n < 2:
+        return ratio, None
+    residuals = sum((y - ratio * x) ** 2 for y, x in zip(numerators, denominators)) / (n - 1)
+    return ratio, CONFIDENCE_Z * math.sqrt(residuals / n) / (total / n)
+
+def retire_row(instruction):
+    return TimingRow(instruction.output_count, instruction.pc, *instruction.clocks)
+
+class ResultWriter(object):
+    # Writes the rows of result.txt in fetch order while the simulation runs.
+    # Instructions retire out of order, so rows wait in a small reorder buffer
+    # keyed by output_count until no earlier row can still arrive.
+
+    def __init__(self, f, ins_dict, profiler=None):
+        self.f = f
+        self.ins_dict = ins_dict
+        self.profiler = profiler
+        self.pending = {}
+        self.next_count = 0
+        self.num_rows = 0
+        # A list while BlockMemo records a block, as for SetAssociativeCache.
+        self.log = None
+        self.write_header()
+
+    def write_header(self):
+        self.f.write("%-20s %-5s %-5s %-5s %-5s %-5s %-5s %-5s %-5s\n" %('Instruction','Fetch', 'Issue','Read','Exec','Write','RAW','WAW','Struct'))
+
+    def retire(self, instruction):
+        if self.profiler:
+            self.profiler.retire(instruction)
+        if self.log is not None:
+            self.log.append(('retire', instruction, tuple(instruction.clocks)))
+        # Rows sharing an output_count are kept in retire order.
+        self.pending.setdefault(instruction.output_count, []).append(retire_row(instruction))
+
+    def flush(self, bound):
+        # Every row with an output_count below bound has retired.
+        while self.next_count < bound:
+            for row in self.pending.pop(self.next_count, []):
+                self.write_row(row)
+            self.next_count += 1
+
+    def finish(self, fetch_count):
+        # Rows of instructions fetched on the last cycle are not reported.
+        self.flush(fetch_count)
+        self.pending = {}
+
+    def get_state(self):
+        # Plain tuples, so a snapshot doesn't depend on where TimingRow is defined.
+        pending = dict((count, [tuple(row) for row in rows]) for count, rows in self.pending.iteritems())
+        return {'pending': pending, 'next_count': self.next_count, 'num_rows': self.num_rows}
+
+    def set_state(self, state):
+        self.pending = dict((count, [TimingRow(*row) for row in rows]) for count, rows in state['pending'].iteritems())
+        self.next_count = state['next_count']
+        self.num_rows = state['num_rows']
+
+    def write_row(self, row):
+        self.num_rows += 1
+        complete_ins = self.ins_dict.get(row.pc).complete_ins
+        log.debug("Retired %s %s", complete_ins, row[2:])
+        c0, c1, c2, c3, c4, c5, c6,c7 = row[2:]
+        if c0 == -1:
+            c0 = ''
+        if c1 == -1:
+            c1 = ''
+        if c2 == -1:
+            c2 = ''
+        if c3 == -1:
+            c3 = ''
+        if c4 == -1:
+            c4 = ''
+        self.f.write("%-20s %-5s %-5s %-5s %-5s %-5s %-5s %-5s %-5s\n" %(complete_ins, c0, c1, c2, c3, c4, c5, c6, c7))
+
+    def write_summary(self, summary):
+        for line in summary_lines(summary):
+            self.f.write("\n\n%s" %(line))
+
+class ColumnarResultWriter(ResultWriter):
+    # Writes the same rows and counters as ResultWriter in a binary layout that
+    # can be loaded without parsing text (see read_columnar_results):
+    #   COLUMNAR_RESULT_HEADER
+    #   instruction count, then the text of every instruction by PC, one per line
+    #   chunks of up to COLUMNAR_CHUNK_ROWS rows: the row count, then each
+    #     TimingRow column in turn; the clocks as int32 (-1 when not reached) and
+    #     the RAW, WAW and Struct flags as int8 (1 for 'Y')
+    #   a row count of 0, then the SUMMARY_FIELDS as int64
+    # All numbers are little-endian.
+
+    def write_header(self):
+        self.f.write(COLUMNAR_RESULT_HEADER)
+        self.f.write(struct.pack('<I', len(self.ins_dict)))
+        for pc in range(len(self.ins_dict)):
+            self.f.write(self.ins_dict.get(pc).complete_ins + '\n')
+        self.new_chunk()
+
+    def new_chunk(self):
+        self.columns = [array.array('i') for _ in TimingRow._fields[:7]] + [array.array('b') for _ in TimingRow._fields[7:]]
+
+    def write_row(self, row):
+        self.num_rows += 1
+        columns = self.columns
+        for index in range(7):
+            columns[index].append(row[index])
+        for index in range(7, 10):
+            columns[index].append(row[index] == 'Y')
+        if len(columns[0]) == COLUMNAR_CHUNK_ROWS:
+            self.write_chunk()
+
+    def write_chunk(self):
+        if not len(self.columns[0]):
+            return
+        self.f.write(struct.pack('<I', len(self.columns[0])))
+        for column in self.columns:
+            if sys.byteorder == 'big':
+                column.byteswap()
+            self.f.write(column.tostring())
+        self.new_chunk()
+
+    def finish(self, fetch_count):
+        ResultWriter.finish(self, fetch_count)
+        self.write_chunk()
+
+    def write_summary(self, summary):
+        self.f.write(struct.pack('<I', 0))
+        self.f.write(struct.pack('<%sq' %(len(SUMMARY_FIELDS)), *[summary[field] for field in SUMMARY_FIELDS]))
+
+RESULT_WRITERS = {'text': ResultWriter, 'columnar': ColumnarResultWriter}
+
+def read_columnar_results(f):
+    # Loads a file written by ColumnarResultWriter as (columns, instructions,
+    # summary). columns maps every TimingRow field to a NumPy array when NumPy
+    # is installed, and to an array.array otherwise.
+    if f.read(len(COLUMNAR_RESULT_HEADER)) != COLUMNAR_RESULT_HEADER:
+        print "INVALID COLUMNAR RESULT FILE. Please pass a file written with --result-format columnar."
+        sys.exit(1)
+    num_instructions = struct.unpack('<I', f.read(4))[0]
+    instructions = [f.readline().rstrip('\n') for _ in range(num_instructions)]
+    typecodes = ['i'] * 7 + ['b'] * 3
+    data = [[] for _ in typecodes]
+    while True:
+        num_rows = struct.unpack('<I', f.read(4))[0]
+        if num_rows == 0:
+            break
+        for index, typecode in enumerate(typecodes):
+            data[index].append(f.read(num_rows * array.array(typecode).itemsize))
+    values = struct.unpack('<%sq' %(len(SUMMARY_FIELDS)), f.read(8 * len(SUMMARY_FIELDS)))
+    summary = dict(zip(SUMMARY_FIELDS, values))
+    columns = {}
+    for name, typecode, chunks in zip(TimingRow._fields, typecodes, data):
+        if numpy is not None:
+            column = numpy.frombuffer(''.join(chunks), dtype='<i4' if typecode == 'i' else 'i1')
+        else:
+            column = array.array(typecode, ''.join(chunks))
+            if sys.byteorder == 'big':
+                column.byteswap()
+        columns[name] = column
+    return columns, instructions, summary
+
+class Profiler(object):
+    # Opt-in instrumentation for generate_scoreboard, which only calls it when
+    # one is passed to Simulator.run.
+    # - stages: wall-clock seconds spent handling instructions in each pipeline
+    #   state, and how many retired instructions went through each stage.
+    # - functional_units: busy and idle cycles of every row of the unit status.
+    # - stalls: instruction-cycles lost to each cause. d_cache is the extra
+    #   execute cycles of loads and stores, which includes waiting for the bus.
+    # Whatever is seen in a cycle holds until the cycle generate_scoreboard steps
+    # to next, so cycles skipped with --event-driven are counted too, and so are
+    # the cycles before the first fetch. A --resume run counts from the clock of
+    # its snapshot.
+
+    def begin(self, row_index_units):
+        self.unit_names = []
+        for index, unit in enumerate(row_index_units):
+            self.unit_names.append("%s %s" %(unit, row_index_units[:index].count(unit)))
+        self.unit_busy = [0] * len(row_index_units)
+        self.stage_counts = dict((stage, 0) for stage in PIPELINE_STAGES)
+        self.stage_times = dict((stage, 0.0) for stage in PIPELINE_STAGES)
+        self.stalls = dict((cause, 0) for cause in STALL_CAUSES)
+        self.cycle_stalls = dict((cause, 0) for cause in STALL_CAUSES)
+        self.cycles = 0
+        self.current_stage = None
+        self.start_time = self.mark = time.time()
+        self.wall_time = 0.0
+
+    def enter(self, stage):
+        # Time up to now goes to the stage entered before.
+        now = time.time()
+        if self.current_stage is not None:
+            self.stage_times[self.current_stage] += now - self.mark
+        self.current_stage = stage
+        self.mark = now
+
+    def stall(self, cause):
+        self.cycle_stalls[cause] += 1
+
+    def end_cycle(self, cycles, f_unit_status):
+        self.enter(None)
+        self.cycles += cycles
+        for cause, count in self.cycle_stalls.iteritems():
+            if count:
+                self.stalls[cause] += count * cycles
+                self.cycle_stalls[cause] = 0
+        for r, status in enumerate(f_unit_status):
+            if status[0] == 'Y':
+                self.unit_busy[r] += cycles
+
+    def retire(self, instruction):
+        for index, stage in enumerate(PIPELINE_STAGES):
+            if instruction.clocks[index] != -1:
+                self.stage_counts[stage] += 1
+        self.stalls['d_cache'] += instruction.d_cache_miss_penalty
+
+    def finish(self):
+        self.enter(None)
+        self.wall_time = time.time() - self.start_time
+
+    def report(self):
+        stages = dict((stage, {'count': self.stage_counts[stage], 'time': self.stage_times[stage]})
+                        for stage in PIPELINE_STAGES)
+        units = dict((name, {'busy': busy, 'idle': self.cycles - busy})
+                        for name, busy in zip(self.unit_names, self.unit_busy))
+        return {'cycles': self.cycles, 'wall_time': self.wall_time, 'stages': stages,
+                'functional_units': units, 'stalls': dict(self.stalls)}
+
+    def write_json(self, f):
+        json.dump(self.report(), f, indent=2, sort_keys=True)
+        f.write("\n")
+
+class TraceWriter(object):
+    # Streams the per-cycle events of generate_scoreboard as tab separated lines
+    # of cycle, event, output_count, pc, instruction and detail. Events are the
+    # stage an instruction enters (fetch, issue, read, execute, write), flush
+    # for instructions dropped by a taken branch, stall with its cause for
+    # every cycle an instruction waits, and i_cache/d_cache with hit or miss.
+    # Cycles skipped with --event-driven have no events.
+
+    def __init__(self, f):
+        self.f = f
+        self.f.write("cycle\tevent\toutput_count\tpc\tinstruction\tdetail\n")
+
+    def event(self, cycle, event, instruction, detail=''):
+        self.f.write("%s\t%s\t%s\t%s\t%s\t%s\n" %(cycle, event, instruction.output_count, instruction.pc,
+                                                    instruction.complete_ins, detail))
+
+def relative_clock(value, clock):
+    # A clock of a memoized block, counted from the cycle the block starts on.
+    # -1 (stage not reached) becomes None, which no relative clock can be.
+    if value == -1:
+        return None
+    return value - clock
+
+def timing_fields(instruction, clock):
+    # The in-flight fields of an instruction that its timing depends on, with
+    # its clocks relative to clock. exp and temp_result are values, which the
+    # replay of a block computes again.
+    clocks = instruction.clocks
+    return (instruction.state, instruction.stall_lock, instruction.f_unit_index,
+            tuple([relative_clock(value, clock) for value in clocks[:5]]) + tuple(clocks[5:]),
+            instruction.branch_next_ins, instruction.d_cache_miss_penalty)
+
+def set_timing_fields(instruction, fields, clock):
+    instruction.state, instruction.stall_lock, instruction.f_unit_index, clocks, instruction.branch_next_ins, \
+        instruction.d_cache_miss_penalty = fields
+    instruction.clocks = [-1 if value is None else value + clock for value in clocks[:5]] + list(clocks[5:])
+
+# What BlockMemo keeps of a block run in detail:
+#   ops          the operations with an effect outside the timing state, in
+#                run order (see BlockMemo.finish)
+#   new          (pc, output_count - fetch_count) of each instruction fetched
+#                in the block, numbered after those in flight at its start
+#   incomplete   the instructions in flight at its end and exit_fields their
+#                timing_fields; prev the one prev_ins ends up as, -1 for the
+#                prev_ins it started with
+#   tables       copies of the scoreboard tables at its end
+#   scalars      penlety_lock at its end relative to its start, the state of
+#                the bus and what it added to the bus statistics
+#   cycles, fetched and counters
+#                what it adds to clock_counter, fetch_count and the cache counters
+#   next_key     the key of the block entered at its end
+MemoBlock = namedtuple('MemoBlock', ['ops', 'new', 'incomplete', 'exit_fields', 'prev', 'tables', 'scalars', 'cycles',
+                                    'fetched', 'counters', 'next_key'])
+
+class BlockMemo(object):
+    # Replays the timing of basic blocks that start from a pipeline state seen
+    # before, e.g. the iterations of a loop once it has settled. A block starts
+    # whenever the instruction at a branch target enters the pipeline, and is
+    # keyed by its PC and the whole timing state at that cycle, with clocks
+    # relative to it: the in-flight instructions, the scoreboard tables, the
+    # I-cache penalty and the bus. From the same key the pipeline goes through
+    # the same states until the next block, except where a value decides: a
+    # branch outcome, a cache hit or a memory address of 0. So the first run of
+    # a block is recorded in detail, and a replay does only the operations with
+    # an effect beyond the timing (reads, executes, writes, cache accesses and
+    # retired rows) on the current values, checks that every such decision
+    # comes out as recorded and then jumps the pipeline to the recorded end
+    # state. On the first difference the replay is undone and the block is run
+    # in detail again, so results are the same with or without the memo.
+
+    def begin(self, simulator, results):
+        self.simulator = simulator
+        self.results = results
+        self.leaders = set(instruction.target for instruction in simulator.ins_dict.itervalues()
+                            if instruction.target is not None)
+        self.blocks = {}
+        self.recording = None
+        self.log = None
+        # The instruction a replay ended on and the key the next block has.
+        self.chained = None
+        self.entered = 0
+        self.replayed = 0
+        self.mismatches = 0
+        self.replayed_cycles = 0
+
+    def signature(self, pipeline, tables):
+        clock, fetch_count = pipeline['clock_counter'], pipeline['fetch_count']
+        f_unit_status, unit_registers, free_units, i_reg_res_status, f_reg_res_status = tables
+        prev_ins = pipeline['prev_ins']
+        previous_fetch = prev_ins and prev_ins.clocks[0]
+        penlety_lock = pipeline['penlety_lock']
+        # unit_registers follows from f_unit_status.
+        return (tuple([(instruction.pc, fetch_count - instruction.output_count) + timing_fields(instruction, clock)
+                        for instruction in pipeline['incomplete_ins']]),
+                prev_ins and relative_clock(previous_fetch, clock),
+                tuple([tuple(row) for row in f_unit_status]),
+                tuple(sorted([(unit, tuple(rows)) for unit, rows in free_units.iteritems()])),
+                tuple(i_reg_res_status), tuple(f_reg_res_status),
+                None if penlety_lock == -1000 else penlety_lock - clock,
+                self.simulator.bus.timing_state(clock, previous_fetch))
+
+    def enter(self, pipeline, tables):
+        # Called by generate_scoreboard at the start of every block. Returns the
+        # pipeline at the start of the next block if this one was replayed, or
+        # None after starting to record it.
+        self.entered += 1
+        chained = self.chained
+        if chained and chained[0] is pipeline['incomplete_ins'][-1]:
+            key = chained[1]
+        else:
+            key = self.signature(pipeline, tables)
+        if self.recording:
+            self.finish(pipeline, tables, key)
+        block = self.blocks.get(key)
+        if block:
+            end = self.replay(block, pipeline, tables)
+            if end:
+                self.chained = (end['incomplete_ins'][-1], block.next_key)
+                self.replayed += 1
+                self.replayed_cycles += block.cycles
+                return end
+            self.mismatches += 1
+        if block or len(self.blocks) < MEMO_MAX_BLOCKS:
+            self.record(key, pipeline)
+        return None
+
+    def record(self, key, pipeline):
+        self.recording = (key, dict(pipeline), list(pipeline['incomplete_ins']), copy.deepcopy(self.simulator.bus.stats))
+        self.log = []
+        self.simulator.i_cache.log = self.simulator.d_cache.log = self.results.log = self.log
+
+    def abort(self):
+        # Drops the block being recorded, at the end of a run or when it grows
+        # past MEMO_MAX_OPS.
+        self.simulator.i_cache.log = self.simulator.d_cache.log = self.results.log = None
+        self.recording = None
+        self.log = None
+
+    def finish(self, pipeline, tables, next_key):
+        # Turns the log of the block just run in detail into a MemoBlock. The
+        # instructions it names are numbered in order of appearance, those in
+        # flight at its start first, and the ops are
+        #   ('read', n, taken)       taken is the outcome of a BEQ/BNE, else None
+        #   ('execute', n, address)  address is whether there was a non-zero one
+        #   ('write', n)
+        #   ('retire', n, clocks)    the row, with clocks relative to the start
+        #   ('i_search', pc, hit), ('i_insert', pc, None)
+        #   ('d_search', offset, hit), ('d_insert', offset, None)
+        #                            offset is from the address of the last execute
+        key, start, instructions, bus_stats = self.recording
+        log = self.log
+        self.abort()
+        clock, fetch_count = start['clock_counter'], start['fetch_count']
+        if pipeline['clock_counter'] - clock < MEMO_MIN_CYCLES:
+            self.leaders.discard(instructions[-1].pc)
+            return
+        indices = dict((id(instruction), index) for index, instruction in enumerate(instructions))
+        new = []
+        def index_of(instruction):
+            if id(instruction) not in indices:
+                indices[id(instruction)] = len(instructions)
+                instructions.append(instruction)
+                new.append((instruction.pc, instruction.output_count - fetch_count))
+            return indices[id(instruction)]
+        i_cache = self.simulator.i_cache
+        ops = []
+        address = None
+        for entry in log:
+            kind, subject = entry[0], entry[1]
+            if kind == 'read':
+                taken = None
+                if subject.ins_str in CONDITIONAL_BRANCH_INSTRUCTIONS:
+                    taken = bool(entry[2])
+                ops.append(('read', index_of(subject), taken))
+            elif kind == 'execute':
+                address = entry[2]
+                ops.append(('execute', index_of(subject), bool(address)))
+            elif kind == 'write':
+                ops.append(('write', index_of(subject)))
+            elif kind == 'retire':
+                ops.append(('retire', index_of(subject),
+                            tuple([relative_clock(value, clock) for value in entry[2][:5]]) + entry[2][5:]))
+            elif subject is i_cache:
+                ops.append(('i_' + kind, entry[2], entry[3]))
+            else:
+                ops.append(('d_' + kind, entry[2] - address, entry[3]))
+        incomplete = [index_of(instruction) for instruction in pipeline['incomplete_ins']]
+        prev_ins = pipeline['prev_ins']
+        if prev_ins is None:
+            prev = None
+        elif id(prev_ins) in indices:
+            prev = indices[id(prev_ins)]
+        elif prev_ins is start['prev_ins']:
+            prev = -1
+        else:
+            return
+        f_unit_status, unit_registers, free_units, i_reg_res_status, f_reg_res_status = tables
+        saved_tables = ([list(row) for row in f_unit_status],
+                        dict((column, dict((reg, set(rows)) for reg, rows in registers.iteritems()))
+                            for column, registers in unit_registers.iteritems()),
+                        dict((unit, list(rows)) for unit, rows in free_units.iteritems()),
+                        list(i_reg_res_status), list(f_reg_res_status))
+        penlety_lock = pipeline['penlety_lock']
+        bus = self.simulator.bus
+        # The bus relative to the end of the block, with what it added to the
+        # bus statistics.
+        scalars = {'penlety_lock': None if penlety_lock == -1000 else penlety_lock - clock,
+                    'bus': bus.timing_state(pipeline['clock_counter'], prev_ins and prev_ins.clocks[0]),
+                    'bus_stats': dict((requester, dict((name, value - bus_stats[requester][name])
+                                                        for name, value in stats.iteritems()))
+                                        for requester, stats in bus.stats.iteritems())}
+        self.blocks[key] = MemoBlock(ops, new, incomplete,
+                                    [timing_fields(instructions[index], clock) for index in incomplete], prev,
+                                    saved_tables, scalars, pipeline['clock_counter'] - clock,
+                                    pipeline['fetch_count'] - fetch_count,
+                                    dict((name, pipeline[name] - start[name]) for name in MEMO_COUNTERS), next_key)
+
+    def replay(self, block, pipeline, tables):
+        # Returns the pipeline at the end of block, or None with everything
+        # the replay changed put back.
+        simulator = self.simulator
+        clock, fetch_count = pipeline['clock_counter'], pipeline['fetch_count']
+        instructions = list(pipeline['incomplete_ins'])
+        values = [(instruction.exp, instruction.temp_result) for instruction in instructions]
+        for pc, offset in block.new:
+            instructions.append(simulator.ins_dict.get(pc).fetch(fetch_count + offset))
+        i_cache, d_cache, data_mem = simulator.i_cache, simulator.d_cache, simulator.data_mem
+        int_registers = list(simulator.int_registers)
+        i_journal = i_cache.journal = []
+        d_journal = d_cache.journal = []
+        journal = data_mem.journal = []
+        retired = []
+        address = None
+        matched = True
+        for op in block.ops:
+            kind = op[0]
+            if kind == 'read':
+                instruction = instructions[op[1]]
+                instruction.exp = simulator.read_operands(instruction)
+                if op[2] is not None and bool(instruction.exp) != op[2]:
+                    matched = False
+                    break
+            elif kind == 'execute':
+                instruction = instructions[op[1]]
+                # Only the last execute of an instruction, the one that
+                # completes it, sets temp_result in a detailed run.
+                instruction.temp_result, address = simulator.execute_instruction(instruction)
+                if bool(address) != op[2]:
+                    matched = False
+                    break
+            elif kind == 'write':
+                simulator.write_result(instructions[op[1]])
+            elif kind == 'retire':
+                retired.append(op)
+            elif kind == 'i_search':
+                if i_cache.search(op[1]) != op[2]:
+                    matched = False
+                    break
+            elif kind == 'i_insert':
+                i_cache.insert(op[1])
+            elif kind == 'd_search':
+                if d_cache.search(address + op[1]) != op[2]:
+                    matched = False
+                    break
+            else:
+                d_cache.insert(address + op[1])
+        i_cache.journal = d_cache.journal = data_mem.journal = None
+        if not matched:
+            simulator.int_registers = int_registers
+            i_cache.undo(i_journal)
+            d_cache.undo(d_journal)
+            data_mem.undo(journal)
+            for instruction, (exp, temp_result) in zip(pipeline['incomplete_ins'], values):
+                instruction.exp, instruction.temp_result = exp, temp_result
+            return None
+        for _, index, clocks in retired:
+            instruction = instructions[index]
+            instruction.clocks = [-1 if value is None else value + clock for value in clocks[:5]] + list(clocks[5:])
+            self.results.retire(instruction)
+        for index, fields in zip(block.incomplete, block.exit_fields):
+            set_timing_fields(instructions[index], fields, clock)
+        f_unit_status, unit_registers, free_units, i_reg_res_status, f_reg_res_status = tables
+        saved_f_unit_status, saved_unit_registers, saved_free_units, saved_i_reg, saved_f_reg = block.tables
+        # In place, as generate_scoreboard holds the tables.
+        for row, saved in zip(f_unit_status, saved_f_unit_status):
+            row[:] = saved
+        for column, registers in saved_unit_registers.iteritems():
+            unit_registers[column] = dict((reg, set(rows)) for reg, rows in registers.iteritems())
+        for unit, rows in saved_free_units.iteritems():
+            free_units[unit] = list(rows)
+        i_reg_res_status[:] = saved_i_reg
+        f_reg_res_status[:] = saved_f_reg
+        end = dict((name, pipeline[name] + block.counters[name]) for name in MEMO_COUNTERS)
+        penlety_lock = block.scalars['penlety_lock']
+        end['penlety_lock'] = -1000 if penlety_lock is None else penlety_lock + clock
+        simulator.bus.set_timing_state(block.scalars['bus'], clock + block.cycles)
+        for requester, stats in block.scalars['bus_stats'].iteritems():
+            for name, value in stats.iteritems():
+                simulator.bus.stats[requester][name] += value
+        end['clock_counter'] = clock + block.cycles
+        end['fetch_count'] = fetch_count + block.fetched
+        end['incomplete_ins'] = [instructions[index] for index in block.incomplete]
+        if block.prev is None:
+            end['prev_ins'] = None
+        elif block.prev == -1:
+            end['prev_ins'] = pipeline['prev_ins']
+        else:
+            end['prev_ins'] = instructions[block.prev]
+        if self.results.pending:
+            self.results.flush(min([end['fetch_count']] +
+                                    [instruction.output_count for instruction in end['incomplete_ins']]))
+        return end
+
+    def report(self):
+        return "%s of %s blocks replayed (%s cycles), %s mismatches, %s blocks kept" %(self.replayed, self.entered,
+                                            self.replayed_cycles, self.mismatches, len(self.blocks))
 
 def decode_instruction(ins):
     label, ins_str, des, op1, op2, jump_label, displacement = None, None, None, None, None, None, None
@@ -63,112 +790,101 @@ def decode_instruction(ins):
         displacement = int(ins[2].split('(')[0])
     return label, ins_str, des, op1, op2, jump_label, displacement
 
-def read_instructions(f1):
-    ins_seq = []
-    ins_dict = {}
-    cnt = 0
+def assemble(f1):
+    # Decodes the text of a program once into what load_program needs: the
+    # fields of each Instruction in PC order, with every branch target resolved
+    # to a PC, and the symbol table of labels.
+    decoded = []
+    labels = {}
     for line in f1:
         #print line
         ins = line.split()
         #print ins
         if 'HLT' in ins:
-            label, ins_str, des, op1, op2, jump_label, displacement = None, 'HLT', None, None, None, None, None
+            fields = None, 'HLT', None, None, None, None, None
         else:
-            label, ins_str, des, op1, op2, jump_label, displacement = decode_instruction(ins)
-        ins_dict.update({cnt:{'label': label,'ins_str': ins_str,'des': des,
-                    'displacement': displacement,
-                    'op1':op1, 'op2':op2, 'jump_label':jump_label, 'state': -1,
-                    'complete_ins':line.split('\n')[0],'stall_lock':False, 
-                    'functional_unit': INSTRUCTION_UNIT_MAP.get(ins_str).get('unit'),
-                    'f_unit_index':-1, 'exp':None, 'temp_result': -1, 'incomplete_index':-1,
-                    'output_count':0, 'clocks':[-1,-1,-1,-1,-1,'N','N','N'],
-                    'branch_next_ins': False, 'd_cache_miss_penalty':0}})
-        cnt += 1
-        ins_seq.append(line.split('\n')[0])
+            fields = decode_instruction(ins)
+        label = fields[0]
+        if label is not None:
+            labels.setdefault(label, len(decoded))
+        decoded.append((fields, line.split('\n')[0]))
+    instructions = []
+    for (label, ins_str, des, op1, op2, jump_label, displacement), complete_ins in decoded:
+        target = None
+        if jump_label is not None:
+            if jump_label not in labels:
+                print "UNKNOWN LABEL:%s in %s. Please pass only labels defined in the program." %(jump_label, complete_ins)
+                sys.exit()
+            target = labels[jump_label]
+        instructions.append((label, ins_str, des, op1, op2, jump_label, target, displacement, complete_ins))
+    return {'instructions': instructions, 'labels': labels}
+
+def load_program(program):
+    ins_seq = []
+    ins_dict = {}
+    for cnt, fields in enumerate(program['instructions']):
+        ins_dict[cnt] = Instruction(cnt, *fields)
+        ins_seq.append(fields[-1])
     return ins_dict, ins_seq
 
-def init_scoreboard(ins_dict, ins_seq, row_index_units):
-    global I_CACHE_WORD_SIZE
-    global I_CACHE_BLOCK_SIZE
-    global I_CACHE
-    global SET0_CACHE
-    global SET1_CACHE
-
-    scoreboard = [[-1]*8 for _ in range(len(ins_seq))]
-    for r in range(len(ins_seq)):
-        scoreboard[r][5] = 'N'
-        scoreboard[r][6] = 'N'
-        scoreboard[r][7] = 'N'
-    functional_unit_status = [['Y']*9 for _ in range(len(row_index_units))]
-    for r in range(len(row_index_units)):
-        functional_unit_status[r][0] = 'N'
-    int_register_result_status = [None] * 32
-    float_register_result_status = [None] * 32
-    I_CACHE = [[-1]*I_CACHE_WORD_SIZE for _ in range(I_CACHE_BLOCK_SIZE)]
-    for x in SET0_CACHE.get('blocks'):
-        x.update({'addresses':[], 'values':{}})
-    for x in SET1_CACHE.get('blocks'):
-        x.update({'addresses':[], 'values':{}})
-    return scoreboard, functional_unit_status, int_register_result_status, float_register_result_status
-
-def read_config(f2):
-    global I_CACHE_BLOCK_SIZE
-    global I_CACHE_WORD_SIZE
-    units = {}
-    row_index_units = [] 
-    for line in f2:
-        unit_name = line.split(':')[0].upper()
-        if unit_name not in FUNCTIONAL_UNITS:
-            print "INVALID FUNCTIONAL UNIT NAME:%s. Please pass valid names." %(unit_name)
-            sys.exit()
-        num_units = line.split(': ')[1].split(',')[0]
-        num_cycles = int(line.split(': ')[1].split(',')[1].split()[0])
-        if unit_name == 'I-CACHE':
-            I_CACHE_BLOCK_SIZE = int(num_units)
-            I_CACHE_WORD_SIZE = int(num_cycles)
-        if unit_name != 'I-CACHE':
-            units.update({unit_name:int(num_units)})
-        if unit_name == 'FP ADDER':
-            INSTRUCTION_UNIT_MAP['ADD.D']['num_cycles'] = num_cycles
-            INSTRUCTION_UNIT_MAP['SUB.D']['num_cycles'] = num_cycles
-        elif unit_name == 'FP MULTIPLIER':
-            INSTRUCTION_UNIT_MAP['MUL.D']['num_cycles'] = num_cycles
-        elif unit_name == 'FP DIVIDER':
-            INSTRUCTION_UNIT_MAP['DIV.D']['num_cycles'] = num_cycles
-    units.update({'INTEGER':1,'DATA TRANSFER': 1,'CONTROL':1,'SPECIAL PURPOSE':1})
-    for key, val in units.iteritems():
-        for cnt in range(val):
-            row_index_units.append(key)
-    return units, row_index_units
-
-def read_data(f3):
-    global MEMORY_LOCATIONS
-    global DATA_MEM
-    index = 0
-    memory_initial_address = 256
-    for line in f3:
-        DATA_MEM.update({memory_initial_address: int(line,2)})
-        memory_initial_address += 4
-        MEMORY_LOCATIONS[index] = int(line, 2)
-        index += 1
+def read_instructions(f1):
+    return load_program(assemble(f1))
+
+def write_program(program, f):
+    f.write(ASSEMBLED_PROGRAM_HEADER)
+    cPickle.dump(program, f, cPickle.HIGHEST_PROTOCOL)
+
+def read_program_file(inst_file, cache_dir=None):
+    # inst_file is either the text of a program or one written by
+    # write_program. With cache_dir, a text program is assembled once and kept
+    # there under the SHA-1 of its contents, so later runs skip the parsing.
+    f = open(inst_file, "rb")
+    text = f.read()
+    f.close()
+    if text.startswith(ASSEMBLED_PROGRAM_HEADER):
+        return cPickle.loads(text[len(ASSEMBLED_PROGRAM_HEADER):])
+    if text.startswith(ASSEMBLED_PROGRAM_MAGIC):
+        print "OUTDATED PROGRAM FILE:%s. Please assemble it again." %(inst_file)
+        sys.exit()
+    if cache_dir is None:
+        return assemble(StringIO(text))
+    cache_file = os.path.join(cache_dir, hashlib.sha1(ASSEMBLED_PROGRAM_HEADER + text).hexdigest() + '.prog')
+    if os.path.exists(cache_file):
+        return read_program_file(cache_file)
+    program = assemble(StringIO(text))
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # Written under a temporary name first, so concurrent runs never read half a file.
+    fd, temp_file = tempfile.mkstemp(dir=cache_dir)
+    f = os.fdopen(fd, "wb")
+    write_program(program, f)
+    f.close()
+    os.rename(temp_file, cache_file)
+    return program
+
+def write_snapshot(snapshot, f):
+    f.write(SNAPSHOT_HEADER)
+    f.write(zlib.compress(cPickle.dumps(snapshot, cPickle.HIGHEST_PROTOCOL)))
+
+def read_snapshot(snapshot_file):
+    f = open(snapshot_file, "rb")
+    data = f.read()
+    f.close()
+    if not data.startswith(SNAPSHOT_HEADER):
+        print "INVALID SNAPSHOT FILE:%s. Please pass a file written with --snapshot." %(snapshot_file)
+        sys.exit()
+    return cPickle.loads(zlib.decompress(data[len(SNAPSHOT_HEADER):]))
 
 def display_ins_dict(ins_dict):
     for key, val in ins_dict.iteritems():
         print "%s:%s" %(key,val)
 
-def check_functional_unit_status(unit, row_index_units, f_unit_status):
-    unit_index_list = []
-    for index,u in enumerate(row_index_units):
-        if u == unit:
-            unit_index_list.append(index)
-    for unit_index in unit_index_list:
-        if f_unit_status[unit_index][0] == 'N':
-            return unit_index
+def check_functional_unit_status(unit, free_units):
+    free = free_units.get(unit)
+    if free:
+        return free[-1]
     return -1
 
-def find_index_of_current_instruction(ins_seq, instruction):
-    return ins_seq.index(instruction)
-
 def check_for_WAW_hazrd(destination_reg, int_reg_res_status, float_reg_res_status):
     if destination_reg and destination_reg[0] == 'R':
         if int_reg_res_status[int(destination_reg[1:len(destination_reg)]) - 1]:
@@ -178,27 +894,28 @@ def check_for_WAW_hazrd(destination_reg, int_reg_res_status, float_reg_res_statu
             return True
     return False
 
-def update_functional_unit(unit_index, f_unit_status, instruction, num_rows):
+def update_functional_unit(unit_index, f_unit_status, unit_registers, instruction, free_units):
+    # unit_index is the one check_functional_unit_status just returned.
+    free_units[instruction.functional_unit].pop()
     f_unit_status[unit_index][0] = 'Y'
-    f_unit_status[unit_index][1] = instruction['ins_str']
-    f_unit_status[unit_index][2] = instruction['des']
-    f_unit_status[unit_index][3] = instruction['op1']
-    f_unit_status[unit_index][4] = instruction['op2']
+    f_unit_status[unit_index][1] = instruction.ins_str
+    f_unit_status[unit_index][2] = instruction.des
+    f_unit_status[unit_index][3] = instruction.op1
+    f_unit_status[unit_index][4] = instruction.op2
     f_unit_status[unit_index][5] = None
     f_unit_status[unit_index][6] = None
-    if instruction['op1']:
-        for r in range(num_rows):
-            if r != unit_index and instruction['op1'] == f_unit_status[r][2]:
-                f_unit_status[unit_index][7] = 'N'
-                break
-    if instruction['op2']:
-        for r in range(num_rows):
-            if r != unit_index and instruction['op2'] == f_unit_status[r][2]:
-                f_unit_status[unit_index][8] = 'N'
-                break
+    producers = unit_registers[2]
+    if instruction.op1 and producers.get(instruction.op1):
+        f_unit_status[unit_index][7] = 'N'
+    if instruction.op2 and producers.get(instruction.op2):
+        f_unit_status[unit_index][8] = 'N'
+    for column in (2, 3, 4):
+        reg = f_unit_status[unit_index][column]
+        if reg:
+            unit_registers[column].setdefault(reg, set()).add(unit_index)
 
 def check_RAW_hazard(instruction, f_unit_status):
-    unit_index = instruction['f_unit_index']
+    unit_index = instruction.f_unit_index
     if f_unit_status[unit_index][7] == 'Y' and f_unit_status[unit_index][8] == 'Y':
         return False
     return True
@@ -209,544 +926,1259 @@ def update_output_registers(destination_reg, i_reg_res_status, f_reg_res_status)
     elif destination_reg and destination_reg[0] == 'F':
         f_reg_res_status[int(destination_reg[1:len(destination_reg)]) - 1] = destination_reg
 
-def read_register(register):
-    global INT_REGISTERS
-    if register[0] == 'R':
-        val = INT_REGISTERS[int(register[1:len(register)]) - 1]
-    elif register[0] == 'F':
-        val = 0
-    #print "Register is:%s and val is;%s" %(register, val)
-    return val
-
-def extract_values(instruction):
-    op1_val, op2_val = None, None
-    if instruction['ins_str'] in ['DADD','DSUB', 'AND', 'OR']:
-        op1_val = read_register(instruction['op1'])
-        op2_val = read_register(instruction['op2'])
-    elif instruction['ins_str'] in ['DADDI','DSUBI', 'ANDI', 'ORI']: 
-        op1_val = read_register(instruction['op1'])
-        op2_val = int(instruction['op2'])
-    elif instruction['ins_str'] in ['ADD.D', 'MUL.D','SUB.D','DIV.D']:
-        op1_val = 0
-        op2_val = 0
-    return op1_val, op2_val
-
-def load_register(instruction):
-    val = None
-    if instruction['ins_str'] in ['LW','L.D']:
-        base_register = instruction['op1']
-        #print "Base Register:%s" %base_register
-        #val = read_register(base_register) - 256
-        val = read_register(base_register)
-        #print "Value is:%s" %val
-    elif instruction['ins_str'] in ['LI','LUI']:
-        #print 'Instruction is;%s and value is%s' %(instruction['complete_ins'], instruction['op1'])
-        val = int(instruction['op1'])
-    return val
-
-def store_register(instruction):
-    val = None
-    if instruction['ins_str'] == 'SW': 
-        val1 = read_register(instruction['op1'])
-        val2 = read_register(instruction['des'])
-        val = "%s##%s" %(val1, val2)
-    elif instruction['ins_str'] == 'S.D':
-        val2 = read_register(instruction['des'])
-        val1 = "0"
-        val = "%s##%s" %(val1, val2)
-    return val
-
-def make_expression(v1, v2, instruction):
-    operation = STRING_OPERTOR_MAP.get(instruction['ins_str'])
-    return "%s%s%s" %(v1, operation, v2)
-
-def execute_conditional_branch(instruction):
-    op1_val = read_register(instruction['op1'])
-    op2_val = read_register(instruction['op2'])
-    if instruction['ins_str'] == 'BNE':
-        if op1_val != op2_val:
-            return True
-    elif instruction['ins_str'] == 'BEQ':
-        if op1_val == op2_val:
-            return True
-    return False
-    
-def read_operands_and_make_expression(instruction):
-    exp = None
-    if instruction['ins_str'] in THREE_OPERAND_INSTRUCTIONS:
-        v1, v2 = extract_values(instruction)
-        if v1 and v2:
-            exp = make_expression(v1, v2, instruction)
-    elif instruction['ins_str'] in LOAD_INSTRUCTIONS:
-        exp = load_register(instruction)
-        #print "Instruction is:%s and exp is;%s" %(instruction['complete_ins'], exp)
-    elif instruction['ins_str'] in STORE_INSTRUCTIONS:
-        exp = store_register(instruction)
-    elif instruction['ins_str'] in CONDITIONAL_BRANCH_INSTRUCTIONS:
-        exp = execute_conditional_branch(instruction)
-    elif instruction['ins_str'] in UNCONDITIONAL_BRANCH_INSTRUCTIONS:
-        exp = execute_unconditional_branch(instruction)
-    return exp
-
-def execute_instruction(instruction):
-    global MEMORY_LOCATIONS
-    global DATA_MEM
-    #print MEMORY_LOCATIONS
-    result, address = None, None
-    if instruction['ins_str'] in THREE_OPERAND_INSTRUCTIONS:
-        if instruction['exp']:
-            result = eval(instruction['exp'])
-    elif instruction['ins_str'] in LOAD_INSTRUCTIONS:
-        res = instruction['exp']
-        #print "Instruction is:%s and result is;%s" %(instruction['complete_ins'], res)
-        if instruction['ins_str'] in ['LW','L.D']:
-            displacement = instruction['displacement']
-            base_value = res
-            if (displacement + base_value) > 380:
-                print "Accessing Out of Memory Data.."
-                sys.exit(0)
-            address = displacement + base_value
-            result = DATA_MEM[displacement + base_value]
-        elif instruction['ins_str'] == 'LI':
-            if res is not None:
-                result = int(res)
-                #print "Instruction is:%s and result in LI block is:%s" %(instruction['complete_ins'], res)
-        elif instruction['ins_str'] == 'LUI':
-            if res is not None:
-                result = int(res)
-                result = result << 16
-    elif instruction['ins_str'] in STORE_INSTRUCTIONS:
-        result = instruction['exp']
-        if instruction['ins_str'] in ['SW', 'S.D']:
-            #print "Result in Destination SW is;%s" %(result)
-            source_val = int(result.split('##')[0])
-            des_val = int(result.split('##')[1]) 
-            displacement = instruction['displacement']
-            if (displacement + des_val) > 380:
-                print "Accessing Out of Memory Data.."
-                sys.exit(0)
-            address = displacement + des_val
-            #MEMORY_LOCATIONS[des_val + displacement] = source_val
-            DATA_MEM[des_val + displacement] = source_val
-    elif instruction['ins_str'] in CONDITIONAL_BRANCH_INSTRUCTIONS:
-        pass
-    return result, address
-
-def write_result(instruction):
-    #print "Instruction is:%s and result in write is:%s" %(instruction['complete_ins'], instruction['temp_result'])
-    global INT_REGISTERS
-    reg = instruction['des']
-    #print "Instruction is %s and destination is %s" %(instruction['complete_ins'], reg)
-    if reg[0] == 'R' and instruction['temp_result'] is not None:
-        INT_REGISTERS[int(reg[1:len(reg)]) - 1] = instruction['temp_result']
-        
-def clear_functional_unit(instruction, f_unit_status, num_rows):
-    unit_index = instruction['f_unit_index']
+def clear_functional_unit(instruction, f_unit_status, unit_registers, free_units):
+    unit_index = instruction.f_unit_index
+    free_units[instruction.functional_unit].append(unit_index)
+    for column in (2, 3, 4):
+        reg = f_unit_status[unit_index][column]
+        if reg:
+            unit_registers[column][reg].discard(unit_index)
     output_reg = f_unit_status[unit_index][2]
-    for r in range(num_rows):
-        if r != unit_index and output_reg == f_unit_status[r][3]:
+    if output_reg:
+        for r in unit_registers[3].get(output_reg, ()):
             f_unit_status[r][7] = 'Y'
-        if r != unit_index and output_reg == f_unit_status[r][4]:
+        for r in unit_registers[4].get(output_reg, ()):
             f_unit_status[r][8] = 'Y'
     f_unit_status[unit_index][0] = 'N'
     for n in range(1,9):
         f_unit_status[unit_index][n] = 'Y'
 
 def clear_output_registers(instruction, int_register_result_status, float_register_result_status):
-    des = instruction['des']
+    des = instruction.des
     if des and des[0] == 'R':
         int_register_result_status[int(des[1:len(des)]) - 1] = None
     elif des and des[0] == 'F':
         float_register_result_status[int(des[1:len(des)]) - 1] = None
 
-def handle_branch_result(instruction, instruction_index, output_list, exp, ins_dict, fetch_count):
+def handle_branch_result(instruction, next_ins, exp, ins_dict, fetch_count):
     is_branch_taken = False
     loop_start_ins = None
     if exp:
         #print "Branch Satisfied..."
-        f_k = None
-        jump_label = instruction['jump_label']
-        #print jump_label
-        #print ins_dict
-        for key,val in ins_dict.iteritems():
-            if val.get('label') == jump_label:
-                f_k = key
-                break
-        loop_start_ins = deepcopy(ins_dict.get(f_k))
-        loop_start_ins.update({'stall_lock':False, 'f_unit_index':-1, 'exp': None, 'temp_result': -1, 
-            'incomplete_ins': -1, 'output_count': fetch_count, 'state':-1, 'clocks':[-1,-1,-1,-1,-1,'N','N','N']})  
-        #output_list.append(deepcopy(ins_dict.get(instruction_index+1)))
+        loop_start_ins = ins_dict.get(instruction.target).fetch(fetch_count)
         is_branch_taken = True
     else:
         #print "Seq Count:%s" %(instruction_index)
         #print "Instruction Dict:%s" %(ins_dict)
-        ins = ins_dict.get(instruction_index+1)
-        if ins:
-            ins['stall_lock'] = False
+        if next_ins:
+            next_ins.stall_lock = False
     return (is_branch_taken, loop_start_ins)
 
-def populate_instruction_cache(instruction_index):
-    global I_CACHE
-    global I_CACHE_BLOCK_SIZE
-    global I_CACHE_WORD_SIZE
-    
-    block_no = (instruction_index / I_CACHE_WORD_SIZE) % I_CACHE_BLOCK_SIZE
-    start_word_address = instruction_index - (instruction_index % I_CACHE_WORD_SIZE)
-    for i in range(I_CACHE_WORD_SIZE):
-        I_CACHE[block_no][i] = start_word_address
-        start_word_address += 1
-
-def check_instruction_cache(instruction_index):
-    global I_CACHE
-    global I_CACHE_BLOCK_SIZE
-    global I_CACHE_WORD_SIZE
-    
-    block_no = (instruction_index / I_CACHE_WORD_SIZE) % I_CACHE_BLOCK_SIZE
-    offset = instruction_index % I_CACHE_WORD_SIZE
-
-    if I_CACHE[block_no][offset] == instruction_index:
-        return False
-    else:
+def next_event_cycle(incomplete_ins, clock_counter, penlety_lock):
+    # Earliest cycle after clock_counter at which an in-flight instruction can
+    # change state on its own: an I-cache penalty expiring or an execute
+    # latency (including any D-cache miss penalty) running out. Everything else
+    # only moves after one of these, so the cycles in between are idle.
+    next_cycle = None
+    for instruction in incomplete_ins:
+        if instruction.state == -1:
+            if penlety_lock == -1000:
+                return clock_counter + 1
+            wake_cycle = penlety_lock + 1
+        elif instruction.state == 2 and instruction.stall_lock is False:
+            wake_cycle = instruction.clocks[2] + instruction.d_cache_miss_penalty + \
+                        instruction.num_cycles
+        elif instruction.state == 3:
+            return clock_counter + 1
+        else:
+            continue
+        if wake_cycle > clock_counter and (next_cycle is None or wake_cycle < next_cycle):
+            next_cycle = wake_cycle
+    if next_cycle is None:
+        return clock_counter + 1
+    return next_cycle
+
+def read_replacement_policy(name):
+    policy = name.upper()
+    if policy not in REPLACEMENT_POLICIES:
+        print "INVALID REPLACEMENT POLICY:%s. Please pass one of %s." %(name, ', '.join(REPLACEMENT_POLICIES))
+        sys.exit()
+    return policy
+
+class SetAssociativeCache(object):
+    # Tags only, since values are always read from memory. Way w of set s is
+    # slot s * num_ways + w of the flat arrays, and blocks maps each resident
+    # block number (address / block_size) to its slot, so a lookup is a single
+    # dict probe whatever the geometry. stamps orders the ways of a set for
+    # replacement: last use for LRU, fill time for FIFO.
+
+    def __init__(self, num_sets, num_ways, block_size, policy='LRU', seed=0):
+        self.num_sets = num_sets
+        self.num_ways = num_ways
+        self.block_size = block_size
+        self.policy = policy
+        self.tags = [-1] * (num_sets * num_ways)
+        self.stamps = [0] * (num_sets * num_ways)
+        self.blocks = {}
+        self.clock = 0
+        self.random = random.Random(seed)
+        # A list while BlockMemo records a block: every search and insert is
+        # appended to it.
+        self.log = None
+        # A list while BlockMemo replays a block, of what each change to a slot
+        # replaced so that they can be undone.
+        self.journal = None
+
+    def search(self, address):
+        hit = self.touch(address // self.block_size)
+        if self.log is not None:
+            self.log.append(('search', self, address, hit))
+        return hit
+
+    def touch(self, block):
+        slot = self.blocks.get(block)
+        if slot is None:
+            return False
+        if self.policy == 'LRU':
+            if self.journal is not None:
+                self.journal.append((slot, block, self.stamps[slot], self.clock, None))
+            self.clock += 1
+            self.stamps[slot] = self.clock
         return True
 
-def calculate_set_no(address):
-    return (((address / 4) / 4) % 2)
-
-def insert_into_data_cache(address):
-    global SET0_CACHE
-    global SET1_CACHE
-    global DATA_MEM
-
-    oldest_block = 0
-    is_empty_block_found = False
-    set_no = calculate_set_no(address)
-    start_word_address = address - (address % 16)
-    if set_no == 0:
-        for index, block in enumerate(SET0_CACHE.get('blocks')):
-            if not block.get('addresses'):
-                is_empty_block_found = True
-                for b in range(4):
-                    block['addresses'].append(start_word_address)
-                    block['values'].update({start_word_address:DATA_MEM.get(start_word_address)})
-                    start_word_address += 4
-                SET0_CACHE['latest_block_index'] = index
+    def insert(self, address):
+        block = address // self.block_size
+        if self.log is not None:
+            self.log.append(('insert', self, address, None))
+        if self.touch(block):
+            return
+        first_slot = (block % self.num_sets) * self.num_ways
+        slots = range(first_slot, first_slot + self.num_ways)
+        victim = None
+        random_state = None
+        for slot in slots:
+            if self.tags[slot] == -1:
+                victim = slot
                 break
-        if not is_empty_block_found:
-            if SET0_CACHE['latest_block_index'] == 0:
-                oldest_block = 1
+        if victim is None:
+            if self.policy == 'RANDOM':
+                if self.journal is not None:
+                    random_state = self.random.getstate()
+                victim = self.random.choice(slots)
+            else:
+                victim = min(slots, key=self.stamps.__getitem__)
+            del self.blocks[self.tags[victim]]
+        if self.journal is not None:
+            self.journal.append((victim, self.tags[victim], self.stamps[victim], self.clock, random_state))
+        self.tags[victim] = block
+        self.blocks[block] = victim
+        self.clock += 1
+        self.stamps[victim] = self.clock
+
+    def get_state(self):
+        state = dict(vars(self))
+        state['random'] = self.random.getstate()
+        return state
+
+    def undo(self, journal):
+        for slot, tag, stamp, clock, random_state in reversed(journal):
+            if self.tags[slot] != -1:
+                del self.blocks[self.tags[slot]]
+            if tag != -1:
+                self.blocks[tag] = slot
+            self.tags[slot], self.stamps[slot], self.clock = tag, stamp, clock
+            if random_state is not None:
+                self.random.setstate(random_state)
+
+    @classmethod
+    def from_state(cls, state):
+        cache = cls.__new__(cls)
+        cache.__dict__.update(state)
+        cache.log = cache.journal = None
+        cache.random = random.Random()
+        cache.random.setstate(state['random'])
+        return cache
+
+class DataMemory(object):
+    # Data memory as a flat image of 32-bit big-endian words starting at
+    # DATA_BASE_ADDRESS: a bytearray built from the text format, or a read-only
+    # mmap of a binary file, so a large image is neither copied nor parsed into
+    # a dict. The image is never written. Stores go to a sparse dict on top of
+    # it, which reset() clears for the next run.
+
+    def __init__(self, image, base_address=DATA_BASE_ADDRESS):
+        self.image = image
+        self.base_address = base_address
+        self.end_address = base_address + len(image)
+        self.stores = {}
+        # A list while BlockMemo replays a block, of what each store replaced
+        # so that they can be undone.
+        self.journal = None
+
+    @classmethod
+    def from_text(cls, f):
+        # One word per line, written in binary.
+        words = [int(line, 2) for line in f if line.strip()]
+        image = bytearray(DATA_WORD.size * len(words))
+        for index, word in enumerate(words):
+            DATA_WORD.pack_into(image, index * DATA_WORD.size, word)
+        return cls(image)
+
+    @classmethod
+    def from_binary(cls, f):
+        f.seek(0, 2)
+        if f.tell() == 0:
+            return cls(bytearray())
+        return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def reset(self):
+        self.stores = {}
+
+    def contains(self, address):
+        return self.base_address <= address and address + DATA_WORD.size <= self.end_address
+
+    def load(self, address):
+        if address in self.stores:
+            return self.stores[address]
+        return DATA_WORD.unpack_from(self.image, address - self.base_address)[0]
+
+    def store(self, address, value):
+        if self.journal is not None:
+            self.journal.append((address, address in self.stores, self.stores.get(address)))
+        self.stores[address] = value
+
+    def undo(self, journal):
+        for address, was_stored, value in reversed(journal):
+            if was_stored:
+                self.stores[address] = value
             else:
-                oldest_block = 0
-            #Now Replace oldest block
-            SET0_CACHE['blocks'][oldest_block]['addresses'] = []
-            SET0_CACHE['blocks'][oldest_block]['values'] = {}
-            for b in range(4):
-                SET0_CACHE['blocks'][oldest_block]['addresses'].append(start_word_address)
-                SET0_CACHE['blocks'][oldest_block]['values'].update({start_word_address:DATA_MEM.get(start_word_address)})
-                start_word_address += 4
-            SET0_CACHE['latest_block_index'] = oldest_block
-    elif set_no == 1: 
-        for index, block in enumerate(SET1_CACHE.get('blocks')):
-            if not block.get('addresses'):
-                is_empty_block_found = True
-                for b in range(4):
-                    block['addresses'].append(start_word_address)
-                    block['values'].update({start_word_address:DATA_MEM.get(start_word_address)})
-                    start_word_address += 4
-                SET1_CACHE['latest_block_index'] = index
+                del self.stores[address]
+
+def read_bus_policy(name):
+    policy = name.upper()
+    if policy not in BUS_POLICIES:
+        print "INVALID BUS POLICY:%s. Please pass one of %s." %(name, ', '.join(BUS_POLICIES))
+        sys.exit()
+    return policy
+
+class SystemBus(object):
+    # The memory bus shared by the I-cache and D-cache. A refill of n words
+    # takes latency + n * cycles_per_word cycles of it.
+    #
+    # PREEMPT, the default, is the original model: an I-cache refill takes the
+    # bus at once, and every D-cache access waits until the instruction being
+    # refilled has been fetched; D-cache refills don't hold the bus. Under the
+    # other policies every refill holds the bus in turn, from a queue of
+    # outstanding requests that is served in request order (FIFO) or with the
+    # requests of one cache first (I-CACHE, D-CACHE). An I-cache refill can
+    # start from the fetch of the previous instruction, as under PREEMPT.
+    #
+    # stats holds, for each requester, the number of refills, their transfer
+    # cycles and the cycles spent waiting for the bus. Under PREEMPT the
+    # D-cache waits are those of every access, hits included.
+
+    def __init__(self, latency=0, cycles_per_word=3, policy='PREEMPT'):
+        self.latency = latency
+        self.cycles_per_word = cycles_per_word
+        self.policy = policy
+        self.queued = policy != 'PREEMPT'
+        # Whether a D-cache access is waiting for the bus, and since when.
+        self.pending = False
+        self.wait_start = -1
+        # PREEMPT: whether the bus is free and when the last I-cache refill ends.
+        self.available = False
+        self.release_time = -1
+        # The other policies: the outstanding request of each requester as
+        # [earliest start, cycles, end or None until it has the bus], those
+        # without the bus in request order, and the first cycle it is free.
+        self.requests = {}
+        self.queue = []
+        self.free_at = 0
+        self.stats = dict((requester, {'refills': 0, 'transfer_cycles': 0, 'wait_cycles': 0})
+                            for requester in BUS_REQUESTERS)
+
+    def transfer_cycles(self, words):
+        return self.latency + self.cycles_per_word * words
+
+    def count(self, requester, cycles, wait):
+        stats = self.stats[requester]
+        stats['refills'] += 1
+        stats['transfer_cycles'] += cycles
+        stats['wait_cycles'] += wait
+
+    def request(self, requester, earliest, cycles, clock):
+        self.requests[requester] = [earliest, cycles, None]
+        self.queue.append(requester)
+        self.arbitrate(clock)
+
+    def arbitrate(self, clock):
+        # Hands the bus to the next request in the queue once it is free.
+        while self.queue and self.free_at <= clock:
+            requester = self.queue[0]
+            if self.policy == 'I-CACHE' and 'i_cache' in self.queue:
+                requester = 'i_cache'
+            elif self.policy == 'D-CACHE' and 'd_cache' in self.queue:
+                requester = 'd_cache'
+            self.queue.remove(requester)
+            request = self.requests[requester]
+            start = max(request[0], self.free_at)
+            request[2] = self.free_at = start + request[1]
+            self.count(requester, request[1], start - request[0])
+
+    def fetch_miss(self, clock, previous_fetch, cycles):
+        # An I-cache miss; returns the penlety_lock of the fetch, which ends
+        # on the cycle after it.
+        if self.queued:
+            self.request('i_cache', previous_fetch, cycles, clock)
+            return self.fetch_lock(clock)
+        self.available = False
+        self.release_time = clock + cycles
+        self.count('i_cache', cycles, 0)
+        return previous_fetch + cycles
+
+    def fetch_lock(self, clock):
+        # The penlety_lock of a fetch whose refill is queued: the current
+        # cycle until the refill has the bus.
+        end = self.requests['i_cache'][2]
+        if end is None:
+            self.arbitrate(clock)
+            end = self.requests['i_cache'][2]
+        if end is None:
+            return clock
+        return end
+
+    def fetched(self):
+        # Any completed fetch ends the I-cache refill.
+        if self.queued:
+            self.requests.pop('i_cache', None)
+        else:
+            self.available = True
+
+    def data_access(self, instruction, clock, miss_penalty):
+        # Whether the D-cache access of instruction can go ahead this cycle.
+        # If not it waits for the bus, which under PREEMPT moves its execute
+        # to the cycle after the I-cache refill ends.
+        if self.queued:
+            if not self.pending:
+                return True
+            end = self.requests['d_cache'][2]
+            if end is None:
+                self.arbitrate(clock)
+                end = self.requests['d_cache'][2]
+            if end is not None:
+                self.pending = False
+                del self.requests['d_cache']
+                instruction.d_cache_miss_penalty = end - (instruction.clocks[2] + instruction.num_cycles)
+            return False
+        if self.available:
+            if self.pending:
+                self.pending = False
+                self.stats['d_cache']['wait_cycles'] += clock - self.wait_start
+            return True
+        if not self.pending:
+            self.pending = True
+            self.wait_start = clock
+        if clock == self.release_time:
+            self.release_time = -1
+            actual_cycle_count = clock + miss_penalty + instruction.num_cycles -1
+            x = actual_cycle_count - (instruction.num_cycles + instruction.clocks[2])
+            instruction.d_cache_miss_penalty = x - miss_penalty
+        return False
+
+    def data_refill(self, instruction, clock, cycles):
+        # A D-cache miss of instruction, found on the cycle its execute was
+        # due; it is due again once the refill is done.
+        if not self.queued:
+            instruction.d_cache_miss_penalty += cycles
+            self.count('d_cache', cycles, 0)
+            return
+        self.request('d_cache', clock, cycles, clock)
+        end = self.requests['d_cache'][2]
+        if end is None:
+            self.pending = True
+            self.wait_start = clock
+        else:
+            del self.requests['d_cache']
+            instruction.d_cache_miss_penalty = end - (instruction.clocks[2] + instruction.num_cycles)
+
+    def timing_state(self, clock, previous_fetch):
+        # The state the timing depends on, with clocks relative to clock, for
+        # BlockMemo. No request can start before previous_fetch, and a release
+        # already past is never reached.
+        free_at = self.free_at
+        if previous_fetch is not None:
+            free_at = max(free_at, previous_fetch)
+        release_time = None
+        if self.release_time >= clock:
+            release_time = self.release_time - clock
+        return (self.available, release_time, self.pending, self.wait_start - clock if self.pending else None,
+                free_at - clock, tuple(self.queue),
+                tuple(sorted((requester, (earliest - clock, cycles, None if end is None else end - clock))
+                            for requester, (earliest, cycles, end) in self.requests.iteritems())))
+
+    def set_timing_state(self, state, clock):
+        self.available, release_time, self.pending, wait_start, free_at, queue, requests = state
+        self.release_time = -1 if release_time is None else release_time + clock
+        self.wait_start = -1 if wait_start is None else wait_start + clock
+        self.free_at = free_at + clock
+        self.queue = list(queue)
+        self.requests = dict((requester, [earliest + clock, cycles, None if end is None else end + clock])
+                            for requester, (earliest, cycles, end) in requests)
+
+    def get_state(self):
+        return copy.deepcopy(vars(self))
+
+    @classmethod
+    def from_state(cls, state):
+        bus = cls.__new__(cls)
+        bus.__dict__.update(copy.deepcopy(state))
+        return bus
+
+class Simulator(object):
+    # Owns everything a run reads or changes: the decoded program, the
+    # configuration, the data image, the registers and the caches. The program
+    # (as returned by assemble) is loaded once; load_config and load_data can be
+    # called again between runs, and each run starts from the loaded data image.
+
+    def __init__(self, program):
+        self.ins_dict, self.ins_seq = load_program(program)
+        self.labels = program['labels']
+        self.load_config([])
+        self.data_mem = DataMemory(bytearray())
+        self.int_registers = [0] * 32
+        self.d_cache = None
+        self.i_cache = None
+        self.bus = None
+
+    def load_config(self, f2):
+        # Anything config.txt leaves out keeps its default, not the value of an
+        # earlier config.
+        units = {}
+        row_index_units = [] 
+        num_cycles = dict((ins_str, val['num_cycles']) for ins_str, val in INSTRUCTION_UNIT_MAP.iteritems())
+        self.i_cache_block_size, self.i_cache_word_size, self.i_cache_ways, self.i_cache_policy = 0, 0, 1, 'LRU'
+        self.d_cache_sets, self.d_cache_ways, self.d_cache_block_words, self.d_cache_policy = 2, 2, 4, 'LRU'
+        self.bus_latency, self.bus_cycles_per_word, self.bus_policy = 0, 3, 'PREEMPT'
+        for line in f2:
+            unit_name = line.split(':')[0].upper()
+            if unit_name not in FUNCTIONAL_UNITS:
+                print "INVALID FUNCTIONAL UNIT NAME:%s. Please pass valid names." %(unit_name)
+                sys.exit()
+            num_units = line.split(': ')[1].split(',')[0]
+            unit_cycles = int(line.split(': ')[1].split(',')[1].split()[0])
+            fields = [field.strip() for field in line.split(': ')[1].split(',')]
+            if unit_name == 'I-CACHE':
+                # I-Cache: blocks, words per block[, ways[, LRU|FIFO|RANDOM]]
+                self.i_cache_block_size = int(num_units)
+                self.i_cache_word_size = int(unit_cycles)
+                if len(fields) > 2:
+                    self.i_cache_ways = int(fields[2])
+                if self.i_cache_ways < 1 or self.i_cache_block_size % self.i_cache_ways:
+                    print "INVALID I-CACHE WAYS:%s. Please pass a divisor of the number of blocks." %(self.i_cache_ways)
+                    sys.exit()
+                if len(fields) > 3:
+                    self.i_cache_policy = read_replacement_policy(fields[3])
+            elif unit_name == 'D-CACHE':
+                # D-Cache: sets, ways, words per block[, LRU|FIFO|RANDOM]
+                self.d_cache_sets, self.d_cache_ways, self.d_cache_block_words = [int(field) for field in fields[:3]]
+                # The two words of an L.D or S.D can be in different blocks, which
+                # a single block would evict from each other forever.
+                if min(self.d_cache_sets, self.d_cache_ways, self.d_cache_block_words) < 1 or \
+                        self.d_cache_sets * self.d_cache_ways < 2:
+                    print "INVALID D-CACHE GEOMETRY:%s. Please pass at least one set, way and word per block, " \
+                            "and at least two blocks." %(', '.join(fields[:3]))
+                    sys.exit()
+                if len(fields) > 3:
+                    self.d_cache_policy = read_replacement_policy(fields[3])
+            elif unit_name == 'BUS':
+                # Bus: latency, cycles per word[, PREEMPT|FIFO|I-CACHE|D-CACHE]
+                self.bus_latency, self.bus_cycles_per_word = [int(field) for field in fields[:2]]
+                if len(fields) > 2:
+                    self.bus_policy = read_bus_policy(fields[2])
+            else:
+                units.update({unit_name:int(num_units)})
+            if unit_name == 'FP ADDER':
+                num_cycles['ADD.D'] = unit_cycles
+                num_cycles['SUB.D'] = unit_cycles
+            elif unit_name == 'FP MULTIPLIER':
+                num_cycles['MUL.D'] = unit_cycles
+            elif unit_name == 'FP DIVIDER':
+                num_cycles['DIV.D'] = unit_cycles
+        units.update({'INTEGER':1,'DATA TRANSFER': 1,'CONTROL':1,'SPECIAL PURPOSE':1})
+        for key, val in units.iteritems():
+            for cnt in range(val):
+                row_index_units.append(key)
+        self.units = units
+        self.row_index_units = row_index_units
+        self.num_cycles = num_cycles
+
+    def load_data(self, f3, binary=None):
+        # A file named *.bin is a binary image, anything else the text format.
+        if binary is None:
+            binary = getattr(f3, 'name', '').endswith('.bin')
+        if binary:
+            self.data_mem = DataMemory.from_binary(f3)
+        else:
+            self.data_mem = DataMemory.from_text(f3)
+
+    def init_scoreboard(self):
+        # Everything a run changes, set back to the start of a run.
+        for instruction in self.ins_dict.itervalues():
+            instruction.num_cycles = self.num_cycles.get(instruction.ins_str)
+        functional_unit_status = [['Y']*9 for _ in range(len(self.row_index_units))]
+        for r in range(len(self.row_index_units)):
+            functional_unit_status[r][0] = 'N'
+        # For columns 2, 3 and 4 (Fi, Fj, Fk) of functional_unit_status, the busy
+        # rows holding each register, so RAW flags are resolved without a scan.
+        unit_registers = {2: {}, 3: {}, 4: {}}
+        # Free rows of each unit type, lowest index last so that it is handed out first.
+        free_units = {}
+        for index in reversed(range(len(self.row_index_units))):
+            free_units.setdefault(self.row_index_units[index], []).append(index)
+        int_register_result_status = [None] * 32
+        float_register_result_status = [None] * 32
+        self.int_registers = [0] * 32
+        self.data_mem.reset()
+        # Instruction addresses are word indices, so a block is i_cache_word_size of them.
+        self.i_cache = SetAssociativeCache(self.i_cache_block_size / self.i_cache_ways, self.i_cache_ways,
+                                            self.i_cache_word_size, self.i_cache_policy)
+        self.d_cache = SetAssociativeCache(self.d_cache_sets, self.d_cache_ways, 4 * self.d_cache_block_words,
+                                            self.d_cache_policy)
+        self.bus = SystemBus(self.bus_latency, self.bus_cycles_per_word, self.bus_policy)
+        return functional_unit_status, unit_registers, free_units, int_register_result_status, float_register_result_status
+
+    def run(self, f4, skip_idle_cycles=False, profiler=None, trace=None, result_format='text', checkpoint=None,
+            snapshot_at=None, snapshot_file=None, resume=None, max_instructions=None, memo=None):
+        # With a checkpoint from fast_forward, the timed run starts from its state
+        # and PC instead of from the start of the program. With snapshot_at, the
+        # run pauses at the first cycle it reaches from there and writes its whole
+        # state to snapshot_file; resume is such a snapshot (see read_snapshot) to
+        # carry on from. With max_instructions, the run ends once that many rows
+        # have been written. memo is a BlockMemo to replay repeated blocks with.
+        if resume:
+            tables = self.restore_snapshot(resume)
+        else:
+            tables = self.init_scoreboard()
+        f_unit_status, unit_registers, free_units, i_reg_res_status, f_reg_res_status = tables
+        start_pc = 0
+        if checkpoint and not resume:
+            self.restore_checkpoint(checkpoint)
+            start_pc = checkpoint.pc
+        return self.generate_scoreboard(f_unit_status, unit_registers, free_units, i_reg_res_status, f_reg_res_status, f4,
+                                        skip_idle_cycles=skip_idle_cycles, profiler=profiler, trace=trace,
+                                        result_format=result_format, start_pc=start_pc, snapshot_at=snapshot_at,
+                                        snapshot_file=snapshot_file, resume=resume, max_instructions=max_instructions,
+                                        memo=memo)
+
+    def run_sampled(self, f4, sample_period, sample_size, skip_idle_cycles=False):
+        # Times a window of sample_size instructions out of every sample_period
+        # and fast-forwards through the rest, so the timing cost grows with the
+        # number of windows. Each window starts from the registers, memory and
+        # warm caches fast_forward reached there, with an empty pipeline; the
+        # state it ends in is dropped. The intervals cover the sampling error
+        # only, not the cost of filling the pipeline of every window. CPI, stall cycles per instruction and the
+        # hit rates are estimated from the windows and written to f4 after their
+        # summed cache counters.
+        checkpoint = self.fast_forward(max_instructions=0)
+        windows = []
+        while self.ins_dict.get(checkpoint.pc) and self.ins_dict.get(checkpoint.pc).ins_str != 'HLT':
+            profiler = Profiler()
+            summary = self.run(StringIO(), skip_idle_cycles=skip_idle_cycles, profiler=profiler, checkpoint=checkpoint,
+                                max_instructions=sample_size)
+            summary['stalls'] = profiler.stalls
+            # Rows flushed by a taken branch are not in the count fast_forward
+            # makes, so the estimates are per issued instruction.
+            summary['issued'] = profiler.stage_counts['issue']
+            windows.append(summary)
+            checkpoint = self.fast_forward(max_instructions=sample_period, start=checkpoint)
+        totals = dict((field, sum(window[field] for window in windows)) for field in SUMMARY_FIELDS)
+        instructions = [window['issued'] for window in windows]
+        estimates = {'cpi': ratio_estimate([window['cycles'] for window in windows], instructions),
+                    'i_cache_hit_rate': ratio_estimate([window['i_cache_hits'] for window in windows],
+                                                        [window['i_cache_accesses'] for window in windows]),
+                    'd_cache_hit_rate': ratio_estimate([window['d_cache_hits'] for window in windows],
+                                                        [window['d_cache_accesses'] for window in windows])}
+        for cause in STALL_CAUSES:
+            estimates['%s_stall_cycles_per_instruction' %(cause)] = ratio_estimate(
+                                            [window['stalls'][cause] for window in windows], instructions)
+        cpi, half_width = estimates['cpi']
+        if cpi is None:
+            estimates['cycles'] = (None, None)
+        else:
+            estimates['cycles'] = (cpi * checkpoint.instructions,
+                                    half_width and half_width * checkpoint.instructions)
+        summary = dict(totals)
+        summary.update({'instructions': checkpoint.instructions, 'cycles': estimates['cycles'][0],
+                        'samples': len(windows), 'sample_period': sample_period, 'sample_size': sample_size,
+                        'estimates': estimates})
+        f4.write("\n\n".join(summary_lines(summary)))
+        return summary
+
+    def program_digest(self):
+        return hashlib.sha1('\n'.join(self.ins_seq)).hexdigest()
+
+    def take_snapshot(self, tables, pipeline, results):
+        # Everything a paused run needs to carry on: the configuration it ran
+        # with, the architectural state, the scoreboard tables, the in-flight
+        # instructions and the other locals of generate_scoreboard, and the rows
+        # not yet written. The data image itself is not included, so a resumed
+        # run must load the same data file.
+        config = dict((name, getattr(self, name)) for name in
+                        ['units', 'row_index_units', 'num_cycles', 'i_cache_block_size', 'i_cache_word_size',
+                        'i_cache_ways', 'i_cache_policy', 'd_cache_sets', 'd_cache_ways', 'd_cache_block_words',
+                        'd_cache_policy', 'bus_latency', 'bus_cycles_per_word', 'bus_policy'])
+        return {'program': self.program_digest(), 'config': config, 'int_registers': list(self.int_registers),
+                'data_stores': dict(self.data_mem.stores), 'i_cache': self.i_cache.get_state(),
+                'd_cache': self.d_cache.get_state(), 'bus': self.bus.get_state(), 'tables': tables, 'pipeline': pipeline,
+                'results': results.get_state()}
+
+    def restore_snapshot(self, snapshot):
+        # The configuration, registers, stores and caches of the snapshot; returns
+        # its scoreboard tables. generate_scoreboard restores the rest.
+        if snapshot['program'] != self.program_digest():
+            print "SNAPSHOT PROGRAM MISMATCH. Please resume with the program the snapshot was taken from."
+            sys.exit()
+        for name, value in snapshot['config'].iteritems():
+            setattr(self, name, value)
+        self.init_scoreboard()
+        self.int_registers = list(snapshot['int_registers'])
+        self.data_mem.stores = dict(snapshot['data_stores'])
+        self.i_cache = SetAssociativeCache.from_state(snapshot['i_cache'])
+        self.d_cache = SetAssociativeCache.from_state(snapshot['d_cache'])
+        self.bus = SystemBus.from_state(snapshot['bus'])
+        return copy.deepcopy(snapshot['tables'])
+
+    def fast_forward(self, stop_pc=None, max_instructions=None, start=None):
+        # Runs the program with no timing, one whole instruction at a time,
+        # through the same read_operands, execute_instruction and write_result as
+        # a timed run, from its start or from the Checkpoint start. The caches
+        # are filled as a timed run would fill them. Stops on reaching stop_pc,
+        # after max_instructions more or at HLT, and returns the Checkpoint to
+        # pass to run.
+        self.init_scoreboard()
+        pc = 0
+        previous = 0
+        if start:
+            self.restore_checkpoint(start)
+            pc = start.pc
+            previous = start.instructions
+        ins_dict = self.ins_dict
+        read_operands, execute_instruction, write_result = self.read_operands, self.execute_instruction, self.write_result
+        i_cache, d_cache = self.i_cache, self.d_cache
+        executed = 0
+        while pc != stop_pc and executed != max_instructions:
+            # The decoded instruction itself holds exp and temp_result here, which
+            # every fetch overwrites before a timed run reads them.
+            instruction = ins_dict.get(pc)
+            if instruction is None or instruction.ins_str == 'HLT':
                 break
-        if not is_empty_block_found:
-            if SET1_CACHE['latest_block_index'] == 0:
-                oldest_block = 1
+            i_cache.insert(pc)
+            executed += 1
+            if instruction.ins_str in UNCONDITIONAL_BRANCH_INSTRUCTIONS:
+                pc = instruction.target
+                continue
+            instruction.exp = read_operands(instruction)
+            if instruction.ins_str in CONDITIONAL_BRANCH_INSTRUCTIONS:
+                if instruction.exp:
+                    pc = instruction.target
+                else:
+                    pc += 1
+                continue
+            temp_result, address = execute_instruction(instruction)
+            if address is not None:
+                d_cache.insert(address)
+                if instruction.ins_str in ['L.D', 'S.D']:
+                    d_cache.insert(address + 4)
+            if instruction.ins_str not in STORE_INSTRUCTIONS:
+                instruction.temp_result = temp_result
+                write_result(instruction)
+            pc += 1
+        return Checkpoint(pc, previous + executed, list(self.int_registers), dict(self.data_mem.stores),
+                            copy.deepcopy(self.i_cache), copy.deepcopy(self.d_cache))
+
+    def restore_checkpoint(self, checkpoint):
+        # Copies, so that one checkpoint can start any number of runs.
+        self.int_registers = list(checkpoint.int_registers)
+        self.data_mem.stores = dict(checkpoint.data_stores)
+        self.i_cache = copy.deepcopy(checkpoint.i_cache)
+        self.d_cache = copy.deepcopy(checkpoint.d_cache)
+
+    def find_pc(self, name):
+        # A PC given as a number or as a label of the program.
+        if name in self.labels:
+            return self.labels[name]
+        if not name.isdigit() or int(name) not in self.ins_dict:
+            print "UNKNOWN PC:%s. Please pass a label or the index of an instruction." %(name)
+            sys.exit()
+        return int(name)
+
+    def read_register(self, register):
+        if register[0] == 'R':
+            val = self.int_registers[int(register[1:len(register)]) - 1]
+        elif register[0] == 'F':
+            val = 0
+        #print "Register is:%s and val is;%s" %(register, val)
+        return val
+
+    def extract_values(self, instruction):
+        operand_type = instruction.operation.operand_type
+        if operand_type == 'REGISTER':
+            return self.read_register(instruction.op1), self.read_register(instruction.op2)
+        elif operand_type == 'IMMEDIATE':
+            return self.read_register(instruction.op1), int(instruction.op2)
+        return 0, 0
+
+    def load_register(self, instruction):
+        val = None
+        if instruction.ins_str in ['LW','L.D']:
+            base_register = instruction.op1
+            #print "Base Register:%s" %base_register
+            #val = self.read_register(base_register) - 256
+            val = self.read_register(base_register)
+            #print "Value is:%s" %val
+        elif instruction.ins_str in ['LI','LUI']:
+            #print 'Instruction is;%s and value is%s' %(instruction.complete_ins, instruction.op1)
+            val = int(instruction.op1)
+        return val
+
+    def store_register(self, instruction):
+        val = None
+        if instruction.ins_str == 'SW': 
+            val = (self.read_register(instruction.op1), self.read_register(instruction.des))
+        elif instruction.ins_str == 'S.D':
+            val = (0, self.read_register(instruction.des))
+        return val
+
+    def execute_conditional_branch(self, instruction):
+        op1_val = self.read_register(instruction.op1)
+        op2_val = self.read_register(instruction.op2)
+        if instruction.ins_str == 'BNE':
+            if op1_val != op2_val:
+                return True
+        elif instruction.ins_str == 'BEQ':
+            if op1_val == op2_val:
+                return True
+        return False
+
+    def read_operands(self, instruction):
+        exp = None
+        if instruction.ins_str in THREE_OPERAND_INSTRUCTIONS:
+            exp = self.extract_values(instruction)
+        elif instruction.ins_str in LOAD_INSTRUCTIONS:
+            exp = self.load_register(instruction)
+            #print "Instruction is:%s and exp is;%s" %(instruction.complete_ins, exp)
+        elif instruction.ins_str in STORE_INSTRUCTIONS:
+            exp = self.store_register(instruction)
+        elif instruction.ins_str in CONDITIONAL_BRANCH_INSTRUCTIONS:
+            exp = self.execute_conditional_branch(instruction)
+        elif instruction.ins_str in UNCONDITIONAL_BRANCH_INSTRUCTIONS:
+            exp = execute_unconditional_branch(instruction)
+        return exp
+
+    def execute_instruction(self, instruction):
+        result, address = None, None
+        if instruction.ins_str in THREE_OPERAND_INSTRUCTIONS:
+            v1, v2 = instruction.exp
+            result = instruction.operation.function(v1, v2)
+        elif instruction.ins_str in LOAD_INSTRUCTIONS:
+            res = instruction.exp
+            #print "Instruction is:%s and result is;%s" %(instruction.complete_ins, res)
+            if instruction.ins_str in ['LW','L.D']:
+                displacement = instruction.displacement
+                base_value = res
+                address = displacement + base_value
+                if not self.data_mem.contains(address):
+                    print "Accessing Out of Memory Data.."
+                    sys.exit(0)
+                result = self.data_mem.load(address)
+            elif instruction.ins_str == 'LI':
+                if res is not None:
+                    result = int(res)
+                    #print "Instruction is:%s and result in LI block is:%s" %(instruction.complete_ins, res)
+            elif instruction.ins_str == 'LUI':
+                if res is not None:
+                    result = int(res)
+                    result = result << 16
+        elif instruction.ins_str in STORE_INSTRUCTIONS:
+            result = instruction.exp
+            if instruction.ins_str in ['SW', 'S.D']:
+                source_val, des_val = result
+                displacement = instruction.displacement
+                address = displacement + des_val
+                if not self.data_mem.contains(address):
+                    print "Accessing Out of Memory Data.."
+                    sys.exit(0)
+                self.data_mem.store(address, source_val)
+        elif instruction.ins_str in CONDITIONAL_BRANCH_INSTRUCTIONS:
+            pass
+        return result, address
+
+    def write_result(self, instruction):
+        #print "Instruction is:%s and result in write is:%s" %(instruction.complete_ins, instruction.temp_result)
+        reg = instruction.des
+        #print "Instruction is %s and destination is %s" %(instruction.complete_ins, reg)
+        if reg[0] == 'R' and instruction.temp_result is not None:
+            self.int_registers[int(reg[1:len(reg)]) - 1] = instruction.temp_result
+
+    def generate_scoreboard(self, f_unit_status, unit_registers, free_units, i_reg_res_status, f_reg_res_status, f4,
+                            skip_idle_cycles=False, profiler=None, trace=None, result_format='text', start_pc=0,
+                            snapshot_at=None, snapshot_file=None, resume=None, max_instructions=None, memo=None): 
+        ins_dict = self.ins_dict
+        if profiler:
+            profiler.begin(self.row_index_units)
+        if memo and (profiler or trace):
+            # Replayed blocks would have no stage, stall or trace events.
+            log.warning("Block memoization is off while profiling or tracing")
+            memo = None
+        bus = self.bus
+        i_cache_miss_penalty = bus.transfer_cycles(self.i_cache_word_size)
+        d_cache_miss_penalty = bus.transfer_cycles(self.d_cache_block_words)
+        # Looked up once so the cache paths below don't call into logging when it is off.
+        debug = log.isEnabledFor(logging.DEBUG)
+        write_ins = []
+        results = RESULT_WRITERS[result_format](f4, ins_dict, profiler)
+        fetch_count = 1
+        penlety_lock = -1000
+        terminate_scoreboard = False
+        previous_ins = None
+        prev_ins = None
+        i_cache_access_count = 0
+        d_cache_access_count = 0
+        d_cache_miss_count = 0
+        tables = (f_unit_status, unit_registers, free_units, i_reg_res_status, f_reg_res_status)
+        # The recording of the block being run in detail, if any; memo_block is
+        # the instruction that started the current block.
+        memo_log = None
+        memo_block = None
+        if memo:
+            memo.begin(self, results)
+        pipeline = None
+        if resume:
+            pipeline = dict(resume['pipeline'])
+            pipeline['incomplete_ins'] = [restore_in_flight(record, ins_dict) for record in pipeline['incomplete_ins']]
+            # Only the fetch clock of prev_ins is ever read, so a copy will do.
+            if pipeline['prev_ins']:
+                pipeline['prev_ins'] = restore_in_flight(pipeline['prev_ins'], ins_dict)
+            results.set_state(resume['results'])
+        else:
+            incomplete_ins = [ins_dict.get(start_pc).fetch(0)]
+            # Only a cache warmed by fast_forward can already hold the first instruction.
+            if self.i_cache.search(start_pc):
+                clock_counter = 1
+                i_cache_miss_count = 0
             else:
-                oldest_block = 0
-            #Now Replace oldest block
-            SET1_CACHE['blocks'][oldest_block]['addresses'] = []
-            SET1_CACHE['blocks'][oldest_block]['values'] = {}
-            for b in range(4):
-                SET1_CACHE['blocks'][oldest_block]['addresses'].append(start_word_address)
-                SET1_CACHE['blocks'][oldest_block]['values'].update({start_word_address:DATA_MEM.get(start_word_address)})
-                start_word_address += 4
-            SET1_CACHE['latest_block_index'] = oldest_block
-
-def search_in_data_cache(address):
-    global SET0_CACHE
-    global SET1_CACHE
-    global DATA_MEM
-    is_found = True
-    set_no = calculate_set_no(address)
-    if set_no == 0: 
-        for index, block in enumerate(SET0_CACHE.get('blocks')):
-            if address in block['addresses']:
-                #Cache hit - No Penalty
-                SET0_CACHE['latest_block_index'] = index
-                return is_found
-
-        #Following call may be shifted in giant loop for proper cycle counting
-        #insert_into_data_cache(address)     
-    elif set_no == 1: 
-        for index, block in enumerate(SET1_CACHE.get('blocks')):
-            if address in block['addresses']:
-                #Cache hit - No Penalty
-                SET1_CACHE['latest_block_index'] = index
-                return is_found
-
-        #Following call may be shifted in giant loop for proper cycle counting
-        #insert_into_data_cache(address)
-    return False
+                self.i_cache.insert(start_pc)
+                clock_counter = i_cache_miss_penalty + 1
+                i_cache_miss_count = 1
+                if trace:
+                    trace.event(clock_counter, 'i_cache', incomplete_ins[0], 'miss')
+            incomplete_ins[0].clocks[0] = clock_counter
+            # No unit is busy while the first instruction is fetched.
+            if profiler:
+                profiler.end_cycle(clock_counter, f_unit_status)
 
-def generate_scoreboard(f_unit_status, i_reg_res_status, f_reg_res_status, ins_dict, ins_seq, row_index_units, f4): 
-    i_cache_miss_penalty = 3 * I_CACHE_WORD_SIZE
-    populate_instruction_cache(0)
-    clock_counter = 3 * I_CACHE_WORD_SIZE + 1
-    incomplete_ins = [ins_dict.get(0)]
-    incomplete_ins[0]['state'] = -1
-    incomplete_ins[0]['output_count'] = 0
-    incomplete_ins[0]['clocks'][0] = i_cache_miss_penalty + 1
-    write_ins = []
-    output_list  = []
-    fetch_count = 1
-    penlety_lock = -1000
-    is_system_bus_available = False
-    bus_acquisition_counter = -1
-    bus_release_time = -1
-    pending_bus_req = False
-    terminate_scoreboard = False
-    previous_ins = None
-    i_cache_miss_count = 1
-    i_cache_access_count = 0
-    d_cache_access_count = 0
-    d_cache_miss_count = 0
-
-    while(True):
-        n = len(incomplete_ins)
-        main_index = 0
-        if len(incomplete_ins) == 2:
-            if incomplete_ins[0]['ins_str'] == 'HLT' and incomplete_ins[1]['ins_str'] == 'HLT':
-                if incomplete_ins[0]['clocks'][1] != -1 and incomplete_ins[1]['clocks'][0] != -1:
-                    output_list.append(incomplete_ins[0])
-                    output_list.append(incomplete_ins[1])
-                    break
-        if clock_counter == 128:
-            print "Incomplete list:%s" %(incomplete_ins)
-        while main_index < n:
-            instruction = incomplete_ins[main_index]
-            instruction_index = find_index_of_current_instruction(ins_seq, instruction['complete_ins'])
-            if instruction['state'] == 0 and instruction['stall_lock'] is False:
-                unit_index = check_functional_unit_status(instruction['functional_unit'], row_index_units, f_unit_status)
-                if unit_index == -1:
-                    instruction['clocks'][7] = 'Y'
-                WAW_status = check_for_WAW_hazrd(instruction['des'], i_reg_res_status, f_reg_res_status)
-                if WAW_status:
-                    instruction['clocks'][6] = 'Y'
-                if WAW_status is False and unit_index != -1:
-                    instruction['state'] = 1
-                    instruction['f_unit_index'] = unit_index
-                    instruction['clocks'][1] = clock_counter
-                    update_output_registers(instruction['des'], i_reg_res_status, f_reg_res_status)
-                    update_functional_unit(unit_index, f_unit_status, instruction, len(row_index_units))
-                    if ins_dict.get(instruction_index+1):
-                        incomplete_ins.append(ins_dict.get(instruction_index+1))
-                        incomplete_ins[-1]['state'] = -1
-                        #incomplete_ins[-1]['clocks'][0] = clock_counter
-                        incomplete_ins[-1]['output_count'] = fetch_count
-                        prev_ins = instruction
-                        n = n + 1
-                        fetch_count += 1
-                        if instruction['ins_str'] in ['BEQ', 'BNE', 'J']:
-                            incomplete_ins[-1]['stall_lock'] = True
-                    if instruction['ins_str'] == 'J':
-                        branch_res = handle_branch_result(instruction, instruction_index, output_list, True, ins_dict, fetch_count)
-                        incomplete_ins[-1]['stall_lock'] = False
-                        if branch_res[0]:
-                            #branch_res[1]['clocks'][0] = clock_counter + 1
-                            incomplete_ins.append(branch_res[1])
-                            incomplete_ins[main_index+1]['branch_next_ins'] = True
-                            #incomplete_ins.pop(main_index+1)
-                        clear_functional_unit(instruction, f_unit_status, len(row_index_units))
-                        incomplete_ins.pop(main_index)
-                        output_list.append(deepcopy(instruction))
+        while(True):
+            if pipeline:
+                # Resuming from a snapshot, or at the end of a replayed block.
+                clock_counter, fetch_count, penlety_lock = pipeline['clock_counter'], pipeline['fetch_count'], pipeline['penlety_lock']
+                i_cache_miss_count, i_cache_access_count = pipeline['i_cache_miss_count'], pipeline['i_cache_access_count']
+                d_cache_miss_count, d_cache_access_count = pipeline['d_cache_miss_count'], pipeline['d_cache_access_count']
+                incomplete_ins, prev_ins = pipeline['incomplete_ins'], pipeline['prev_ins']
+                pipeline = None
+            if len(incomplete_ins) == 2:
+                if incomplete_ins[0].ins_str == 'HLT' and incomplete_ins[1].ins_str == 'HLT':
+                    if incomplete_ins[0].clocks[1] != -1 and incomplete_ins[1].clocks[0] != -1:
+                        results.retire(incomplete_ins[0])
+                        results.retire(incomplete_ins[1])
                         break
-            elif instruction['state'] == -1:
-                if check_instruction_cache(instruction_index) and penlety_lock == -1000:
-                    i_cache_miss_count += 1
-                    is_system_bus_available = False
-                    bus_release_time = clock_counter + i_cache_miss_penalty
-                    #bus_acquisition_counter = clock_counter 
-                    penlety_lock = prev_ins['clocks'][0] + i_cache_miss_penalty
-                if penlety_lock < clock_counter:
-                    i_cache_access_count += 1
-                    if instruction['ins_str'] in ['L.D','S.D']:
-                        d_cache_access_count += 2
-                    elif instruction['ins_str'] in ['LW','SW']:
-                        d_cache_access_count += 1 
-                    is_system_bus_available = True
-                    bus_acquisition_counter = -1
-                    populate_instruction_cache(instruction_index)
-                    instruction['state'] = 0
-                    instruction['clocks'][0] = clock_counter
-                    penlety_lock = -1000
-                    if instruction['branch_next_ins']:
-                        output_list.append(deepcopy(instruction))
-                        #incomplete_ins[main_index + 1]['state'] = -1
-                        instruction['branch_next_ins'] = False
-                        incomplete_ins.pop(main_index)
-                        main_index = main_index + 1
-            elif instruction['state'] == 1 and instruction['stall_lock'] is False:
-                is_hazard = check_RAW_hazard(instruction, f_unit_status)
-                if is_hazard is False:
-                    instruction['state'] = 2
-                    instruction['clocks'][2] = clock_counter
-                    exp = read_operands_and_make_expression(instruction)
-                    instruction['exp'] = exp
-                    if instruction['ins_str'] in CONDITIONAL_BRANCH_INSTRUCTIONS:
-                        branch_res = handle_branch_result(instruction, instruction_index, output_list, exp, ins_dict, fetch_count)
-                        if branch_res[0]:
-                            clock_counter += 1
-                            #branch_res[1]['clocks'][0] = clock_counter
-                            incomplete_ins.append(branch_res[1])
-                            incomplete_ins[main_index+1]['branch_next_ins'] = True
-                            #incomplete_ins.pop(main_index+1)
-                        clear_functional_unit(instruction, f_unit_status, len(row_index_units))
-                        incomplete_ins.pop(main_index)
-                        output_list.append(deepcopy(instruction))
-                        break
-                else:
-                    instruction['clocks'][5] = 'Y' 
-            elif instruction['state'] == 2 and instruction['stall_lock'] is False:
-                if instruction['ins_str'] == 'DADD':
-                    print "Clock Counter is:%s" %(clock_counter)
-                if clock_counter - (instruction['d_cache_miss_penalty'] + instruction['clocks'][2]) == INSTRUCTION_UNIT_MAP.get(instruction['ins_str']).get('num_cycles') or pending_bus_req:
-                    if instruction['ins_str'] not in ['CONDITIONAL_BRANCH_INSTRUCTIONS']:
-                        temp_result, address = execute_instruction(instruction)
-                        if instruction['ins_str'] in ['LW','SW'] and address:
-                            if is_system_bus_available is True:
-                                pending_bus_req = False
-                                if search_in_data_cache(address):
-                                    print "Cache Hit for instruction and address:%s %s" %(instruction['complete_ins'], address)
-                                    instruction['state'] = 3
-                                    instruction['temp_result'] = temp_result
-                                    instruction['clocks'][3] = clock_counter
+            if max_instructions is not None and results.num_rows >= max_instructions:
+                break
+            if memo_log is not None and len(memo_log) > MEMO_MAX_OPS:
+                memo.abort()
+                memo_log = None
+            snapshot_now = snapshot_at is not None and clock_counter >= snapshot_at
+            if snapshot_now or (memo and incomplete_ins[-1] is not memo_block and incomplete_ins[-1].state == -1 and
+                                incomplete_ins[-1].pc in memo.leaders):
+                pipeline = {'clock_counter': clock_counter, 'fetch_count': fetch_count, 'penlety_lock': penlety_lock,
+                            'i_cache_miss_count': i_cache_miss_count,
+                            'i_cache_access_count': i_cache_access_count, 'd_cache_miss_count': d_cache_miss_count,
+                            'd_cache_access_count': d_cache_access_count, 'incomplete_ins': incomplete_ins,
+                            'prev_ins': prev_ins}
+            if snapshot_now:
+                if memo:
+                    memo.abort()
+                pipeline['incomplete_ins'] = [save_in_flight(instruction) for instruction in incomplete_ins]
+                pipeline['prev_ins'] = prev_ins and save_in_flight(prev_ins)
+                f = open(snapshot_file, "wb")
+                write_snapshot(self.take_snapshot(tables, pipeline, results), f)
+                f.close()
+                if profiler:
+                    profiler.finish()
+                # Rows still waiting in the reorder buffer are in the snapshot and
+                # are written by the resumed run.
+                return {'cycles': clock_counter, 'instructions': results.num_rows, 'paused': True,
+                        'i_cache_accesses': i_cache_access_count, 'i_cache_hits': i_cache_access_count - i_cache_miss_count,
+                        'd_cache_accesses': d_cache_access_count, 'd_cache_hits': d_cache_access_count - d_cache_miss_count}
+            if pipeline:
+                memo_block = incomplete_ins[-1]
+                pipeline = memo.enter(pipeline, tables)
+                memo_log = memo.log
+                if pipeline:
+                    continue
+            n = len(incomplete_ins)
+            main_index = 0
+            progress = False
+            cycle_start = clock_counter
+            while main_index < n:
+                instruction = incomplete_ins[main_index]
+                instruction_index = instruction.pc
+                if profiler:
+                    profiler.enter(PIPELINE_STAGES[instruction.state + 1])
+                if instruction.state == 0 and instruction.stall_lock is False:
+                    unit_index = check_functional_unit_status(instruction.functional_unit, free_units)
+                    if unit_index == -1:
+                        instruction.clocks[7] = 'Y'
+                        if profiler:
+                            profiler.stall('structural')
+                        if trace:
+                            trace.event(clock_counter, 'stall', instruction, 'structural')
+                    WAW_status = check_for_WAW_hazrd(instruction.des, i_reg_res_status, f_reg_res_status)
+                    if WAW_status:
+                        instruction.clocks[6] = 'Y'
+                        if profiler:
+                            profiler.stall('waw')
+                        if trace:
+                            trace.event(clock_counter, 'stall', instruction, 'waw')
+                    if WAW_status is False and unit_index != -1:
+                        progress = True
+                        instruction.state = 1
+                        instruction.f_unit_index = unit_index
+                        instruction.clocks[1] = clock_counter
+                        if trace:
+                            trace.event(clock_counter, 'issue', instruction)
+                        update_output_registers(instruction.des, i_reg_res_status, f_reg_res_status)
+                        update_functional_unit(unit_index, f_unit_status, unit_registers, instruction, free_units)
+                        if ins_dict.get(instruction_index+1):
+                            incomplete_ins.append(ins_dict.get(instruction_index+1).fetch(fetch_count))
+                            prev_ins = instruction
+                            n = n + 1
+                            fetch_count += 1
+                            if instruction.ins_str in ['BEQ', 'BNE', 'J']:
+                                incomplete_ins[-1].stall_lock = True
+                        if instruction.ins_str == 'J':
+                            branch_res = handle_branch_result(instruction, None, True, ins_dict, fetch_count)
+                            incomplete_ins[-1].stall_lock = False
+                            if branch_res[0]:
+                                #branch_res[1].clocks[0] = clock_counter + 1
+                                incomplete_ins.append(branch_res[1])
+                                incomplete_ins[main_index+1].branch_next_ins = True
+                                #incomplete_ins.pop(main_index+1)
+                            clear_functional_unit(instruction, f_unit_status, unit_registers, free_units)
+                            incomplete_ins.pop(main_index)
+                            results.retire(instruction)
+                            break
+                elif instruction.state == -1:
+                    if not self.i_cache.search(instruction_index) and penlety_lock == -1000:
+                        progress = True
+                        i_cache_miss_count += 1
+                        penlety_lock = bus.fetch_miss(clock_counter, prev_ins.clocks[0], i_cache_miss_penalty)
+                        if trace:
+                            trace.event(clock_counter, 'i_cache', instruction, 'miss')
+                    elif bus.queued and 'i_cache' in bus.requests:
+                        penlety_lock = bus.fetch_lock(clock_counter)
+                    if penlety_lock < clock_counter:
+                        progress = True
+                        i_cache_access_count += 1
+                        if instruction.ins_str in ['L.D','S.D']:
+                            d_cache_access_count += 2
+                        elif instruction.ins_str in ['LW','SW']:
+                            d_cache_access_count += 1 
+                        bus.fetched()
+                        self.i_cache.insert(instruction_index)
+                        instruction.state = 0
+                        instruction.clocks[0] = clock_counter
+                        penlety_lock = -1000
+                        if trace:
+                            trace.event(clock_counter, 'fetch', instruction)
+                        if instruction.branch_next_ins:
+                            if trace:
+                                trace.event(clock_counter, 'flush', instruction)
+                            results.retire(instruction)
+                            #incomplete_ins[main_index + 1].state = -1
+                            instruction.branch_next_ins = False
+                            incomplete_ins.pop(main_index)
+                            main_index = main_index + 1
+                    else:
+                        if profiler:
+                            profiler.stall('i_cache')
+                        if trace:
+                            trace.event(clock_counter, 'stall', instruction, 'i_cache')
+                elif instruction.state == 1 and instruction.stall_lock is False:
+                    is_hazard = check_RAW_hazard(instruction, f_unit_status)
+                    if is_hazard is False:
+                        progress = True
+                        instruction.state = 2
+                        instruction.clocks[2] = clock_counter
+                        if trace:
+                            trace.event(clock_counter, 'read', instruction)
+                        exp = self.read_operands(instruction)
+                        instruction.exp = exp
+                        if memo_log is not None:
+                            memo_log.append(('read', instruction, exp))
+                        if instruction.ins_str in CONDITIONAL_BRANCH_INSTRUCTIONS:
+                            next_ins = None
+                            if main_index + 1 < len(incomplete_ins):
+                                next_ins = incomplete_ins[main_index+1]
+                            branch_res = handle_branch_result(instruction, next_ins, exp, ins_dict, fetch_count)
+                            if branch_res[0]:
+                                clock_counter += 1
+                                #branch_res[1].clocks[0] = clock_counter
+                                incomplete_ins.append(branch_res[1])
+                                if next_ins.state == 0:
+                                    # Already fetched while the branch waited on a RAW hazard, so it
+                                    # would never reach the flush in the fetch stage.
+                                    if trace:
+                                        trace.event(clock_counter, 'flush', next_ins)
+                                    results.retire(next_ins)
+                                    incomplete_ins.pop(main_index+1)
                                 else:
-                                    d_cache_miss_count += 1
-                                    insert_into_data_cache(address)
-                                    print "Cache Miss for instruction and address:%s %s" %(instruction['complete_ins'], address)
-                                    instruction['d_cache_miss_penalty'] += 12
-                            else:
-                                pending_bus_req = True
-                                if clock_counter == bus_release_time:
-                                    bus_release_time = -1
-                                    actual_cycle_count = clock_counter + 12 + INSTRUCTION_UNIT_MAP.get(instruction['ins_str']).get('num_cycles') -1
-                                    x = actual_cycle_count - (INSTRUCTION_UNIT_MAP.get(instruction['ins_str']).get('num_cycles') + instruction['clocks'][2])
-                                    instruction['d_cache_miss_penalty'] = x - 12
-                        elif instruction['ins_str'] in ['L.D','S.D'] and address:
-                            if is_system_bus_available is True:
-                                pending_bus_req = False
-                                if search_in_data_cache(address):
-                                    if search_in_data_cache(address + 4):
-                                        print "Cache Hit for instruction and address:%s %s" %(instruction['complete_ins'], address)
-                                        instruction['state'] = 3
-                                        instruction['temp_result'] = temp_result
-                                        instruction['clocks'][3] = clock_counter
+                                    next_ins.branch_next_ins = True
+                            clear_functional_unit(instruction, f_unit_status, unit_registers, free_units)
+                            incomplete_ins.pop(main_index)
+                            results.retire(instruction)
+                            break
+                    else:
+                        instruction.clocks[5] = 'Y' 
+                        if profiler:
+                            profiler.stall('raw')
+                        if trace:
+                            trace.event(clock_counter, 'stall', instruction, 'raw')
+                elif instruction.state == 2 and instruction.stall_lock is False and instruction.ins_str != 'HLT':
+                    # At or after the cycle the execute is due: a taken branch
+                    # skips a cycle, which may be that one. HLT never executes
+                    # and waits here for the run to end.
+                    if clock_counter - (instruction.d_cache_miss_penalty + instruction.clocks[2]) >= instruction.num_cycles or bus.pending:
+                        if instruction.ins_str not in ['CONDITIONAL_BRANCH_INSTRUCTIONS']:
+                            progress = True
+                            temp_result, address = self.execute_instruction(instruction)
+                            if memo_log is not None:
+                                memo_log.append(('execute', instruction, address))
+                            if instruction.ins_str in ['LW','SW'] and address:
+                                if bus.data_access(instruction, clock_counter, d_cache_miss_penalty):
+                                    if self.d_cache.search(address):
+                                        if debug:
+                                            log.debug("Cache Hit for instruction and address:%s %s", instruction.complete_ins, address)
+                                        if trace:
+                                            trace.event(clock_counter, 'd_cache', instruction, 'hit %s' %(address))
+                                        instruction.state = 3
+                                        instruction.temp_result = temp_result
+                                        instruction.clocks[3] = clock_counter
+                                        if trace:
+                                            trace.event(clock_counter, 'execute', instruction)
                                     else:
                                         d_cache_miss_count += 1
-                                        insert_into_data_cache(address+4)
-                                        instruction['d_cache_miss_penalty'] += 12
+                                        self.d_cache.insert(address)
+                                        if debug:
+                                            log.debug("Cache Miss for instruction and address:%s %s", instruction.complete_ins, address)
+                                        if trace:
+                                            trace.event(clock_counter, 'd_cache', instruction, 'miss %s' %(address))
+                                        bus.data_refill(instruction, clock_counter, d_cache_miss_penalty)
                                 else:
-                                    d_cache_miss_count += 1
-                                    insert_into_data_cache(address)
-                                    if search_in_data_cache(address + 4):
-                                        instruction['d_cache_miss_penalty'] += 12
+                                    if profiler:
+                                        profiler.stall('bus')
+                                    if trace:
+                                        trace.event(clock_counter, 'stall', instruction, 'bus')
+                            elif instruction.ins_str in ['L.D','S.D'] and address:
+                                if bus.data_access(instruction, clock_counter, d_cache_miss_penalty):
+                                    if self.d_cache.search(address):
+                                        if self.d_cache.search(address + 4):
+                                            if debug:
+                                                log.debug("Cache Hit for instruction and address:%s %s", instruction.complete_ins, address)
+                                            if trace:
+                                                trace.event(clock_counter, 'd_cache', instruction, 'hit %s' %(address))
+                                            instruction.state = 3
+                                            instruction.temp_result = temp_result
+                                            instruction.clocks[3] = clock_counter
+                                            if trace:
+                                                trace.event(clock_counter, 'execute', instruction)
+                                        else:
+                                            d_cache_miss_count += 1
+                                            self.d_cache.insert(address+4)
+                                            if debug:
+                                                log.debug("Cache Miss for instruction and address:%s %s", instruction.complete_ins, address + 4)
+                                            if trace:
+                                                trace.event(clock_counter, 'd_cache', instruction, 'miss %s' %(address + 4))
+                                            bus.data_refill(instruction, clock_counter, d_cache_miss_penalty)
                                     else:
                                         d_cache_miss_count += 1
-                                        #insert_into_data_cache(address)
-                                        insert_into_data_cache(address + 4)
-                                        instruction['d_cache_miss_penalty'] += 24
+                                        self.d_cache.insert(address)
+                                        if debug:
+                                            log.debug("Cache Miss for instruction and address:%s %s", instruction.complete_ins, address)
+                                        if trace:
+                                            trace.event(clock_counter, 'd_cache', instruction, 'miss %s' %(address))
+                                        if self.d_cache.search(address + 4):
+                                            bus.data_refill(instruction, clock_counter, d_cache_miss_penalty)
+                                        else:
+                                            d_cache_miss_count += 1
+                                            #self.d_cache.insert(address)
+                                            self.d_cache.insert(address + 4)
+                                            if debug:
+                                                log.debug("Cache Miss for instruction and address:%s %s", instruction.complete_ins, address + 4)
+                                            if trace:
+                                                trace.event(clock_counter, 'd_cache', instruction, 'miss %s' %(address + 4))
+                                            bus.data_refill(instruction, clock_counter, 2 * d_cache_miss_penalty)
+                                else:
+                                    if profiler:
+                                        profiler.stall('bus')
+                                    if trace:
+                                        trace.event(clock_counter, 'stall', instruction, 'bus')
                             else:
-                                pending_bus_req = True
-                                if clock_counter == bus_release_time:
-                                    bus_release_time = -1
-                                    actual_cycle_count = clock_counter + 12 + INSTRUCTION_UNIT_MAP.get(instruction['ins_str']).get('num_cycles') -1
-                                    x = actual_cycle_count - (INSTRUCTION_UNIT_MAP.get(instruction['ins_str']).get('num_cycles') + instruction['clocks'][2])
-                                    instruction['d_cache_miss_penalty'] = x - 12
-                                #instruction['d_cache_miss_penalty'] = 11
-                        else:
-                            if clock_counter - instruction['clocks'][2] == INSTRUCTION_UNIT_MAP.get(instruction['ins_str']).get('num_cycles'): 
-                                instruction['state'] = 3
-                                instruction['temp_result'] = temp_result
-                                instruction['clocks'][3] = clock_counter
-            elif instruction['state'] == 3 and instruction['stall_lock'] is False:
-                instruction['incomplete_index'] = main_index
-                write_ins.append(instruction)
-            main_index = main_index + 1
-
-        for instruction in write_ins: 
-            instruction_index = find_index_of_current_instruction(ins_seq, instruction['complete_ins'])
-            instruction['clocks'][4] = clock_counter
-            if instruction['ins_str'] not in ['SW', 'S.D']:
-                write_result(instruction)
-            clear_functional_unit(instruction, f_unit_status, len(row_index_units))
-            clear_output_registers(instruction, i_reg_res_status, f_reg_res_status)
-            output_list.append(deepcopy(instruction))
-            instruction['state'] = 4
-            instruction['f_unit_index'] = -1
-            instruction['d_cache_miss_penalty'] = 0
-            instruction['exp'] = None
-            instruction['temp_result'] = None
-            incomplete_ins.pop(instruction['incomplete_index'])
-            instruction['incomplete_index'] = -1
-        write_ins = []
-        clock_counter += 1
-    op_list = []
-    s = "%-20s %-5s %-5s %-5s %-5s %-5s %-5s %-5s %-5s\n" %('Instruction','Fetch', 'Issue','Read','Exec','Write','RAW','WAW','Struct')
-    f4.write(s)
-    for i in range(0,fetch_count):
-        for op in output_list:
-            if op and op['output_count'] == i:
-                print "%s\t%s" %(op['complete_ins'], op['clocks'])
-                c0, c1, c2, c3, c4, c5, c6,c7 = op['clocks'][0], op['clocks'][1], op['clocks'][2], op['clocks'][3], op['clocks'][4], op['clocks'][5], op['clocks'][6], op['clocks'][7]
-                if c0 == -1:
-                    c0 = ''
-                if c1 == -1:
-                    c1 = ''
-                if c2 == -1:
-                    c2 = ''
-                if c3 == -1:
-                    c3 = ''
-                if c4 == -1:
-                    c4 = ''
-                op_list.append("%-20s %-5s %-5s %-5s %-5s %-5s %-5s %-5s %-5s\n" %(op['complete_ins'], c0, c1, c2, c3, c4, c5, c6, c7))
-
-    for op in op_list:
-        f4.write(op)
-    print "Total Number of access requsts for instruction cahce:%s" %(i_cache_access_count)
-    f4.write("\n\nTotal Number of access requsts for instruction cahce:%s" %(i_cache_access_count))
-    print "Number of instruction cahce hits:%s" %(i_cache_access_count - i_cache_miss_count)
-    f4.write("\n\nNumber of instruction cahce hits:%s" %(i_cache_access_count - i_cache_miss_count))
-    print "Total Number of Cache requsts for Data Cache:%s" %(d_cache_access_count)
-    f4.write("\n\nTotal Number of Cache requsts for Data Cache:%s" %(d_cache_access_count))
-    print "Total Number of Cache Hits for Data Cache:%s" %(d_cache_access_count - d_cache_miss_count)
-    f4.write("\n\nTotal Number of Cache Hits for Data Cache:%s" %(d_cache_access_count - d_cache_miss_count))
+                                if clock_counter - instruction.clocks[2] >= instruction.num_cycles: 
+                                    instruction.state = 3
+                                    instruction.temp_result = temp_result
+                                    instruction.clocks[3] = clock_counter
+                                    if trace:
+                                        trace.event(clock_counter, 'execute', instruction)
+                elif instruction.state == 3 and instruction.stall_lock is False:
+                    progress = True
+                    instruction.incomplete_index = main_index
+                    write_ins.append(instruction)
+                main_index = main_index + 1
 
+            if profiler:
+                profiler.enter('write')
+            for instruction in write_ins: 
+                instruction.clocks[4] = clock_counter
+                if trace:
+                    trace.event(clock_counter, 'write', instruction)
+                if instruction.ins_str not in ['SW', 'S.D']:
+                    self.write_result(instruction)
+                    if memo_log is not None:
+                        memo_log.append(('write', instruction))
+                clear_functional_unit(instruction, f_unit_status, unit_registers, free_units)
+                clear_output_registers(instruction, i_reg_res_status, f_reg_res_status)
+                results.retire(instruction)
+                instruction.state = 4
+            # Pop from the back so that earlier pops don't shift the later indices.
+            for instruction in reversed(write_ins):
+                incomplete_ins.pop(instruction.incomplete_index)
+            write_ins = []
+            if results.pending:
+                results.flush(min([fetch_count] + [instruction.output_count for instruction in incomplete_ins]))
+            if skip_idle_cycles and not progress and not bus.pending:
+                clock_counter = next_event_cycle(incomplete_ins, clock_counter, penlety_lock)
+            else:
+                clock_counter += 1
+            if profiler:
+                profiler.end_cycle(clock_counter - cycle_start, f_unit_status)
+        results.finish(fetch_count)
+        if profiler:
+            profiler.finish()
+        if memo:
+            memo.abort()
+            log.info("Block memo: %s", memo.report())
+        summary = {'cycles': clock_counter, 'instructions': results.num_rows,
+                    'i_cache_accesses': i_cache_access_count, 'i_cache_hits': i_cache_access_count - i_cache_miss_count,
+                    'd_cache_accesses': d_cache_access_count, 'd_cache_hits': d_cache_access_count - d_cache_miss_count}
+        results.write_summary(summary)
+        summary['bus'] = copy.deepcopy(bus.stats)
+        return summary
 
-if __name__ == '__main__':
-    if len(sys.argv) != 5:
-        print "Usage: python inst.txt data.txt config.txt result.txt"
-        sys.exit(0)
-    inst_file = sys.argv[1]
-    data_file = sys.argv[2]
-    config_file = sys.argv[3]
-    result_file = sys.argv[4]
-    f1 = open(inst_file, "rb")
+def simulate(inst_file, data_file, config_file, result_file, skip_idle_cycles=False, program_cache=None,
+                profile_file=None, trace_file=None, result_format='text', fast_forward=None, fast_forward_to=None,
+                snapshot_at=None, snapshot_file=None, resume_file=None, sample_period=None, sample_size=1000,
+                memoize_blocks=False):
+    # One complete run from the four files, returning the summary of generate_scoreboard.
+    simulator = Simulator(read_program_file(inst_file, program_cache))
+    profiler = None
+    if profile_file:
+        profiler = Profiler()
+    trace = None
+    if trace_file:
+        trace = TraceWriter(open(trace_file, "w", 1 << 20))
     f2 = open(config_file, "rb")
     f3 = open(data_file, "rb")
     f4 = open(result_file, "wb")
-    ins_dict, ins_seq = read_instructions(f1)
-    units, row_index_units = read_config(f2)
-    read_data(f3)
-    scoreboard, f_unit_status, i_reg_res_status, f_reg_res_status = init_scoreboard(ins_dict, ins_seq, row_index_units)
-    generate_scoreboard(f_unit_status, i_reg_res_status, f_reg_res_status, ins_dict, ins_seq, row_index_units, f4)
-    f1.close()
-    f2.close()
-    f3.close()
-    f4.close()
+    try:
+        simulator.load_config(f2)
+        simulator.load_data(f3)
+        checkpoint = None
+        resume = None
+        if sample_period:
+            summary = simulator.run_sampled(f4, sample_period, sample_size, skip_idle_cycles=skip_idle_cycles)
+            for line in summary_lines(summary):
+                print line
+            return summary
+        if resume_file:
+            resume = read_snapshot(resume_file)
+        elif fast_forward is not None or fast_forward_to is not None:
+            stop_pc = None
+            if fast_forward_to is not None:
+                stop_pc = simulator.find_pc(fast_forward_to)
+            checkpoint = simulator.fast_forward(stop_pc, fast_forward)
+            log.info("Fast-forwarded %s instructions to PC %s", checkpoint.instructions, checkpoint.pc)
+        summary = simulator.run(f4, skip_idle_cycles=skip_idle_cycles, profiler=profiler, trace=trace,
+                                result_format=result_format, checkpoint=checkpoint, snapshot_at=snapshot_at,
+                                snapshot_file=snapshot_file, resume=resume, memo=memoize_blocks and BlockMemo())
+        if summary.get('paused'):
+            print "Snapshot of cycle %s written to %s" %(summary['cycles'], snapshot_file)
+        else:
+            for line in summary_lines(summary) + bus_lines(summary['bus']):
+                print line
+    finally:
+        f2.close()
+        f3.close()
+        f4.close()
+        if trace:
+            trace.f.close()
+    if profiler:
+        f = open(profile_file, "w")
+        profiler.write_json(f)
+        f.close()
+    return summary
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="python scoreboard.py inst.txt data.txt config.txt result.txt [--event-driven] [--program-cache DIR] [--profile FILE] [--trace FILE] [--log-level LEVEL] [--result-format FORMAT] [--fast-forward N] [--fast-forward-to PC] [--snapshot-at CYCLE --snapshot FILE] [--resume FILE] [--sample-period N [--sample-size N]] [--memoize-blocks]")
+    parser.add_argument('inst_file',
+                        help="inst.txt, or a program assembled by assemble.py")
+    parser.add_argument('data_file',
+                        help="data.txt, or a binary image of 32-bit big-endian words named *.bin")
+    parser.add_argument('config_file')
+    parser.add_argument('result_file')
+    parser.add_argument('--event-driven', action='store_true',
+                        help="jump straight to the next cycle at which an instruction can change state")
+    parser.add_argument('--program-cache', metavar='DIR',
+                        help="keep assembled programs in DIR and reuse them while inst.txt is unchanged")
+    parser.add_argument('--profile', metavar='FILE',
+                        help="write per-stage times, unit occupancy and stall counts to FILE as JSON")
+    parser.add_argument('--trace', metavar='FILE',
+                        help="write every pipeline event of the run to FILE, one tab separated line each")
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='WARNING',
+                        help="DEBUG also logs every cache access and retired instruction (default: WARNING)")
+    parser.add_argument('--result-format', choices=sorted(RESULT_WRITERS), default='text',
+                        help="columnar writes result.txt as binary columns for read_columnar_results (default: text)")
+    parser.add_argument('--fast-forward', metavar='N', type=int,
+                        help="execute the first N instructions without timing and time the rest of the program")
+    parser.add_argument('--fast-forward-to', metavar='PC',
+                        help="execute without timing until the instruction at PC, a label or an index, is reached")
+    parser.add_argument('--snapshot-at', metavar='CYCLE', type=int,
+                        help="pause the run at CYCLE and save its whole state to the --snapshot file")
+    parser.add_argument('--snapshot', metavar='FILE')
+    parser.add_argument('--resume', metavar='FILE',
+                        help="carry on from a snapshot, with the same program and data; result.txt then holds the "
+                            "rows not written before the pause")
+    parser.add_argument('--sample-period', metavar='N', type=int,
+                        help="time one window every N instructions, fast-forward the rest and write estimates")
+    parser.add_argument('--sample-size', metavar='N', type=int, default=1000,
+                        help="instructions in each timed window (default: 1000)")
+    parser.add_argument('--memoize-blocks', action='store_true',
+                        help="replay the timing of basic blocks that start from a pipeline state seen before")
+    args = parser.parse_args()
+    if (args.snapshot_at is None) != (args.snapshot is None):
+        parser.error("--snapshot-at and --snapshot go together")
+    if args.sample_period is not None:
+        # A sampled run times its own windows and writes only the estimates.
+        unsupported = [('--memoize-blocks', args.memoize_blocks), ('--profile', args.profile is not None),
+                        ('--trace', args.trace is not None), ('--result-format', args.result_format != 'text'),
+                        ('--fast-forward', args.fast_forward is not None),
+                        ('--fast-forward-to', args.fast_forward_to is not None),
+                        ('--snapshot-at', args.snapshot_at is not None), ('--resume', args.resume is not None)]
+        options = [option for option, given in unsupported if given]
+        if options:
+            parser.error("--sample-period can't be combined with %s" %(', '.join(options)))
+    logging.basicConfig(level=getattr(logging, args.log_level), format="%(levelname)s %(message)s")
+    simulate(args.inst_file, args.data_file, args.config_file, args.result_file, skip_idle_cycles=args.event_driven,
+                program_cache=args.program_cache, profile_file=args.profile, trace_file=args.trace,
+                result_format=args.result_format, fast_forward=args.fast_forward, fast_forward_to=args.fast_forward_to,
+                snapshot_at=args.snapshot_at, snapshot_file=args.snapshot, resume_file=args.resume,
+                sample_period=args.sample_period, sample_size=args.sample_size, memoize_blocks=args.memoize_blocks)
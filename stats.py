@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# Post-run statistics over the timing rows of a result file, computed with
+# NumPy over whole columns so that traces with millions of rows stay fast:
+#
+#     python stats.py result.txt config.txt [--json FILE]
+#
+# The result file can be the text table or a --result-format columnar file;
+# the columnar one loads without parsing and is the one to use for big runs.
+# config.txt is the one the run used, for the unit counts and latencies.
+#
+# Stall cycles are read off the gaps between the clocks of each row:
+#   raw         Issue to Read, waiting for operands
+#   waw         Fetch to Issue when the WAW flag is set
+#   structural  Fetch to Issue when only the Struct flag is set
+#   i_cache     previous Issue to Fetch, waiting for the instruction
+#   d_cache     Read to Exec beyond the latency of a load or store
+import sys
+import json
+import argparse
+
+import numpy
+
+import scoreboard
+
+LATENCY_PERCENTILES = [50, 90, 99]
+
+def split_row(line):
+    # The instruction text and the eight columns of a row of the text table.
+    # Each column is its value left-justified in five characters and followed
+    # by a space, so a clock of six or more digits widens its own column and
+    # shifts the ones before it. The columns are taken from the right: the
+    # three flags are always one character, and an unreached clock is five
+    # spaces.
+    flags = line[-17:].split()
+    rest = line[:-18]
+    clocks = []
+    for _ in range(5):
+        stripped = rest.rstrip(' ')
+        if len(rest) - len(stripped) >= 5:
+            clocks.append('')
+            rest = rest[:-5]
+        else:
+            value = stripped.rsplit(' ', 1)[-1]
+            clocks.append(value)
+            rest = stripped[:-len(value)]
+        rest = rest[:-1]
+    clocks.reverse()
+    return rest.strip(), clocks + flags
+
+def read_text_results(f):
+    # The same (columns, instructions, summary) as read_columnar_results, from
+    # the text table. instructions holds the distinct instruction texts and the
+    # pc column indexes it.
+    f.readline()
+    instructions = []
+    ids = {}
+    rows = []
+    summary = {}
+    for line in f:
+        line = line.rstrip('\n')
+        if not line.strip():
+            continue
+        if line.startswith('Total') or line.startswith('Number'):
+            name, value = line.rsplit(':', 1)
+            summary[name] = int(value)
+            continue
+        if line.startswith('Sampled windows:') or line.startswith('Estimated '):
+            print "SAMPLED RESULT FILE. A --sample-period run writes estimates and no rows; run without it for statistics."
+            sys.exit()
+        complete_ins, fields = split_row(line)
+        if complete_ins not in ids:
+            ids[complete_ins] = len(instructions)
+            instructions.append(complete_ins)
+        clocks = [int(field) if field else -1 for field in fields[:5]]
+        rows.append([len(rows), ids[complete_ins]] + clocks + [field == 'Y' for field in fields[5:]])
+    data = numpy.array(rows, dtype=numpy.int64).reshape(-1, len(scoreboard.TimingRow._fields))
+    columns = dict((name, data[:, index]) for index, name in enumerate(scoreboard.TimingRow._fields))
+    summary = {'i_cache_accesses': summary.get('Total Number of access requsts for instruction cahce'),
+                'i_cache_hits': summary.get('Number of instruction cahce hits'),
+                'd_cache_accesses': summary.get('Total Number of Cache requsts for Data Cache'),
+                'd_cache_hits': summary.get('Total Number of Cache Hits for Data Cache'),
+                'instructions': len(rows)}
+    return columns, instructions, summary
+
+def read_results(result_file):
+    f = open(result_file, 'rb')
+    columnar = f.read(len(scoreboard.COLUMNAR_RESULT_HEADER)) == scoreboard.COLUMNAR_RESULT_HEADER
+    f.seek(0)
+    if columnar:
+        results = scoreboard.read_columnar_results(f)
+    else:
+        results = read_text_results(f)
+    f.close()
+    return results
+
+def read_config(config_file):
+    # An empty Simulator just to read config.txt the way a run does.
+    simulator = scoreboard.Simulator({'instructions': [], 'labels': {}})
+    f = open(config_file, 'rb')
+    simulator.load_config(f)
+    f.close()
+    return simulator
+
+def instruction_name(complete_ins):
+    ins = complete_ins.split()
+    if 'HLT' in ins:
+        return 'HLT'
+    return scoreboard.decode_instruction(ins)[1]
+
+def compute_statistics(columns, instructions, summary, simulator):
+    names = [instruction_name(complete_ins) for complete_ins in instructions]
+    unit_types = sorted(simulator.units)
+    unit_of = numpy.array([unit_types.index(scoreboard.INSTRUCTION_UNIT_MAP[name]['unit']) for name in names], dtype=numpy.int64)
+    latency_of = numpy.array([simulator.num_cycles[name] for name in names], dtype=numpy.int64)
+    is_memory = numpy.array([name in ['LW', 'SW', 'L.D', 'S.D'] for name in names], dtype=bool)
+
+    pc = numpy.asarray(columns['pc'], dtype=numpy.int64)
+    fetch, issue, read, execute, write = [numpy.asarray(columns[name], dtype=numpy.int64)
+                                            for name in ['fetch', 'issue', 'read', 'execute', 'write']]
+    raw, waw, struct_flag = [numpy.asarray(columns[name]) != 0 for name in ['raw', 'waw', 'struct']]
+    issued = issue != -1
+    completed = write != -1
+    cycles = summary.get('cycles')
+    if cycles is None:
+        cycles = int(max(fetch.max(), issue.max(), read.max(), execute.max(), write.max())) + 1 if len(pc) else 0
+    num_completed = int(completed.sum())
+
+    latency = (write - issue)[completed & issued]
+    latency_stats = {'count': int(len(latency))}
+    if len(latency):
+        latency_stats.update({'mean': float(latency.mean()), 'min': int(latency.min()), 'max': int(latency.max()),
+                                'histogram': dict((str(value), int(count)) for value, count in
+                                                    enumerate(numpy.bincount(latency)) if count)})
+        for percentile, value in zip(LATENCY_PERCENTILES, numpy.percentile(latency, LATENCY_PERCENTILES)):
+            latency_stats['p%s' %(percentile)] = float(value)
+
+    issue_wait = numpy.where(issued, issue - fetch - 1, 0).clip(0)
+    read_wait = numpy.where(issued & (read != -1), read - issue - 1, 0).clip(0)
+    memory_wait = numpy.where(is_memory[pc] & (execute != -1), execute - read - latency_of[pc], 0).clip(0)
+    fetch_wait = numpy.zeros_like(fetch)
+    if len(pc) > 1:
+        fetch_wait[1:] = numpy.where(issue[:-1] != -1, fetch[1:] - issue[:-1], 0).clip(0)
+    stalls = {'raw': int(read_wait.sum()),
+                'waw': int(issue_wait[waw].sum()),
+                'structural': int(issue_wait[struct_flag & ~waw].sum()),
+                'i_cache': int(fetch_wait.sum()),
+                'd_cache': int(memory_wait.sum())}
+
+    # A unit is held from Issue until Write, or until Read or Issue for the
+    # branches, which free it early.
+    released = numpy.where(completed, write, numpy.where(read != -1, read, issue))
+    busy = numpy.bincount(unit_of[pc][issued], weights=(released - issue)[issued], minlength=len(unit_types))
+    occupancy = {}
+    for index, unit in enumerate(unit_types):
+        capacity = cycles * simulator.units[unit]
+        occupancy[unit] = {'units': simulator.units[unit], 'busy': int(busy[index]),
+                            'occupancy': float(busy[index]) / capacity if capacity else 0.0}
+
+    return {'cycles': int(cycles), 'instructions': num_completed,
+            'cpi': float(cycles) / num_completed if num_completed else None,
+            'ipc': float(num_completed) / cycles if cycles else None,
+            'issue_to_write_latency': latency_stats, 'stalls': stalls, 'functional_units': occupancy}
+
+def print_statistics(stats):
+    print "Cycles:%s Instructions:%s CPI:%s IPC:%s" %(stats['cycles'], stats['instructions'], stats['cpi'], stats['ipc'])
+    latency = stats['issue_to_write_latency']
+    if latency['count']:
+        print "Issue to Write latency: mean %.2f min %s max %s %s" %(latency['mean'], latency['min'], latency['max'],
+                                    " ".join("p%s %.1f" %(p, latency['p%s' %(p)]) for p in LATENCY_PERCENTILES))
+    print "%-16s %s" %('Stall', 'Cycles')
+    for cause in ['raw', 'waw', 'structural', 'i_cache', 'd_cache']:
+        print "%-16s %s" %(cause, stats['stalls'][cause])
+    print "%-16s %-6s %-10s %s" %('Unit', 'Units', 'Busy', 'Occupancy')
+    for unit in sorted(stats['functional_units']):
+        values = stats['functional_units'][unit]
+        print "%-16s %-6s %-10s %.3f" %(unit, values['units'], values['busy'], values['occupancy'])
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="python stats.py result.txt config.txt [--json FILE]")
+    parser.add_argument('result_file',
+                        help="result.txt, or a file written with --result-format columnar")
+    parser.add_argument('config_file')
+    parser.add_argument('--json', metavar='FILE', help="also write the statistics to FILE as JSON")
+    args = parser.parse_args()
+    columns, instructions, summary = read_results(args.result_file)
+    stats = compute_statistics(columns, instructions, summary, read_config(args.config_file))
+    print_statistics(stats)
+    if args.json:
+        f = open(args.json, 'w')
+        json.dump(stats, f, indent=2, sort_keys=True)
+        f.write("\n")
+        f.close()